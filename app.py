@@ -1,29 +1,76 @@
 import os
+import io
+import time
+import atexit
+import cProfile
+import functools
+import hmac
+import secrets
+import threading
+import csv
 import json
 import logging
-from flask import Flask, request, render_template, jsonify, url_for
+from flask import Flask, Response, g, request, render_template, jsonify, send_from_directory, url_for
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import pandas as pd
 from google.cloud import storage
-from flask import session
-from flask_session import Session
 from flask_cors import CORS
+from lms import LMSEngine, age_in_months
+from batch import BatchStage, run_batch
+from jobs import JobQueue
+from charts import ChartRenderer, ChartRenderPool, RenderPoolBusy
+from http_client import HTTPClient
+from bitrix import BitrixBatchWriter
+from inbody import parse_number, parse_report
+from reference_bundle import data_version, load_reference_tables
+from result_cache import ResultCache, delivery_key
+from history import GrowthHistory
+from export import EXPORT_FORMATS, iter_export, parse_time, write_export
+from metrics import MetricsRegistry, timed
+from tokens import RedisTokenBackend, SQLiteTokenBackend, TokenStore
+from uploader import ChartUploader, GCSBackend, LocalBackend, content_address
 
 app = Flask(__name__)
 CORS(app)
 
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "fallback-secret-key")
-app.config["SESSION_TYPE"] = "filesystem"  # Store session data on the server
-
-Session(app)  # Initialize Flask session management
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+# Metrics served at /metrics; every process keeps its own
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram("growth_request_seconds", "Time spent serving a request", ["endpoint", "method", "status"])
+stage_seconds = metrics.histogram("growth_stage_seconds", "Time spent in a processing stage", ["stage"])
+stage_failures = metrics.counter("growth_stage_failures_total", "Processing stages that failed", ["stage"])
+chart_render_seconds = metrics.histogram("growth_chart_render_seconds", "Time spent rendering one chart", ["chart"])
+chart_upload_failures = metrics.counter("growth_chart_upload_failures_total", "Charts that could not be uploaded", ["chart"])
+
+# Profiling: a request carrying "X-Profile: <PROFILE_TOKEN>" is run under cProfile
+# and its stats are dumped to PROFILE_FOLDER (disabled when no token is set)
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', os.path.join(os.getenv('DATA_FOLDER', 'data'), 'profiles'))
+# cProfile allows one active profiler per process
+profile_lock = threading.Lock()
+
+# Recorded measurements (/history, /export, /downloads) are only served to requests
+# carrying "Authorization: Bearer <DATA_ACCESS_TOKEN>" (disabled when no token is set)
+DATA_ACCESS_TOKEN = os.getenv('DATA_ACCESS_TOKEN')
+
+def require_data_token(view):
+    """Reject requests to ``view`` that do not present DATA_ACCESS_TOKEN."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not DATA_ACCESS_TOKEN:
+            return jsonify({"status": "error", "message": "Data access is disabled; set DATA_ACCESS_TOKEN"}), 403
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode(), DATA_ACCESS_TOKEN.encode()):
+            return jsonify({"status": "error", "message": "Invalid or missing access token"}), 401
+        return view(*args, **kwargs)
+    return wrapper
 
 
 BITRIX_CLIENT_ID = os.getenv("BITRIX_CLIENT_ID")
@@ -31,7 +78,36 @@ BITRIX_CLIENT_SECRET = os.getenv("BITRIX_CLIENT_SECRET")
 BITRIX_REDIRECT_URI = "https://who-finall.onrender.com/oauth"
 BITRIX_AUTH_URL = "https://cultiv.bitrix24.com/oauth/authorize/"
 BITRIX_TOKEN_URL = "https://cultiv.bitrix24.com/oauth/token/"
-BITRIX_API_URL = "https://cultiv.bitrix24.com/rest/"
+BITRIX_API_URL = os.getenv("BITRIX_API_URL", "https://cultiv.bitrix24.com/rest/")
+BITRIX_WEBHOOK_URL = os.getenv("BITRIX_WEBHOOK_URL", "https://vitrah.bitrix24.com/rest/1/15urrpzalz7xkysu/")
+BITRIX_RPA_UPDATE_URL = f"{BITRIX_WEBHOOK_URL}rpa.item.update.json"
+BITRIX_BATCH_URL = f"{BITRIX_WEBHOOK_URL}batch.json"
+# Deliveries are remembered per endpoint: the inbound webhook (/process, /batch)
+# and the OAuth REST API (/webhook) may be different portals with overlapping rpa_ids
+WEBHOOK_TARGET = BITRIX_WEBHOOK_URL
+OAUTH_TARGET = BITRIX_API_URL
+
+# Outbound HTTP: timeouts, per-host pool size, retry policy and the Bitrix24 request rate
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.5))
+BITRIX_RATE_LIMIT = float(os.getenv('BITRIX_RATE_LIMIT', 2))
+BITRIX_RATE_BURST = int(os.getenv('BITRIX_RATE_BURST', 50))
+# OAuth token calls get a shorter read timeout, so a refresh always ends well inside its lease
+TOKEN_TIMEOUT = (HTTP_CONNECT_TIMEOUT, float(os.getenv('TOKEN_READ_TIMEOUT', 10)))
+
+http = HTTPClient(
+    timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+    pool_maxsize=HTTP_POOL_SIZE,
+    max_retries=HTTP_MAX_RETRIES,
+    backoff_factor=HTTP_BACKOFF,
+    rate_limits={
+        urlsplit(url).netloc: (BITRIX_RATE_LIMIT, BITRIX_RATE_BURST)
+        for url in (BITRIX_API_URL, BITRIX_RPA_UPDATE_URL)
+    },
+)
 
 def get_bitrix_token(code):
     """Exchange the authorization code for an access token from Bitrix24."""
@@ -43,7 +119,7 @@ def get_bitrix_token(code):
             "redirect_uri": BITRIX_REDIRECT_URI,
             "code": code,
         }
-        response = requests.post(BITRIX_TOKEN_URL, data=payload)
+        response = http.post(BITRIX_TOKEN_URL, data=payload, retries=0, timeout=TOKEN_TIMEOUT)
         token_data = response.json()
 
         if "access_token" in token_data:
@@ -56,28 +132,22 @@ def get_bitrix_token(code):
         logging.error(f"Error in get_bitrix_token(): {e}")
         return None
 
-def refresh_bitrix_token():
-    """Refresh Bitrix24 OAuth Token."""
+def request_token_refresh(refresh_token):
+    """Exchange a refresh token for a new Bitrix24 token response (called by the token store)."""
     try:
-        if "refresh_token" not in session:
-            logging.error("No refresh token found in session.")
-            return None
-        
         payload = {
             "grant_type": "refresh_token",
             "client_id": BITRIX_CLIENT_ID,
             "client_secret": BITRIX_CLIENT_SECRET,
-            "refresh_token": session.get("refresh_token"),
+            "refresh_token": refresh_token,
         }
 
-        response = requests.post(BITRIX_TOKEN_URL, data=payload)
+        response = http.post(BITRIX_TOKEN_URL, data=payload, retries=0, timeout=TOKEN_TIMEOUT)
         token_data = response.json()
 
         if "access_token" in token_data:
-            session["access_token"] = token_data["access_token"]
-            session["refresh_token"] = token_data["refresh_token"]
             logging.info("Bitrix24 OAuth token refreshed successfully.")
-            return token_data["access_token"]
+            return token_data
         else:
             logging.error(f"Failed to refresh Bitrix24 token: {token_data}")
             return None
@@ -85,15 +155,92 @@ def refresh_bitrix_token():
     except Exception as e:
         logging.error(f"Token refresh error: {e}")
         return None
-    
+
+def refresh_bitrix_token(stale=None):
+    """Refresh the shared Bitrix24 token once across all workers; returns the new access token or None."""
+    return token_store.refresh(BITRIX_TOKEN_KEY, stale=stale)
+
+def bitrix_access_token():
+    """The portal's current access token (refreshed ahead of expiry), or None before /oauth has run."""
+    return token_store.access_token(BITRIX_TOKEN_KEY)
+
 # Configuration
-UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'static/charts')
 DOWNLOAD_FOLDER = os.getenv('DOWNLOAD_FOLDER', 'downloads')
+DATA_FOLDER = os.getenv('DATA_FOLDER', 'data')
 GCS_BUCKET_NAME = os.getenv('GCS_BUCKET_NAME', 'child-growth-charts')
 
+# Chart uploads: "gcs" or "local" backend, shared pool size and retry policy
+UPLOAD_BACKEND = os.getenv('UPLOAD_BACKEND', 'gcs')
+LOCAL_UPLOAD_DIR = os.getenv('LOCAL_UPLOAD_DIR', 'data/uploads')
+LOCAL_UPLOAD_BASE_URL = os.getenv('LOCAL_UPLOAD_BASE_URL')
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 12))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv('UPLOAD_MAX_ATTEMPTS', 3))
+UPLOAD_BACKOFF = float(os.getenv('UPLOAD_BACKOFF', 0.5))
+
+# Chart output: "png" or "svg", raster resolution, PNG compression and
+# 8-bit palette quantization, and the number of finished charts kept in memory
+CHART_FORMAT = os.getenv('CHART_FORMAT', 'png')
+CHART_DPI = int(os.getenv('CHART_DPI', 100))
+CHART_PNG_COMPRESS_LEVEL = int(os.getenv('CHART_PNG_COMPRESS_LEVEL', 6))
+CHART_PNG_PALETTE = os.getenv('CHART_PNG_PALETTE', 'false').lower() == 'true'
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 512))
+
+# Chart render processes per web worker ("auto": one per chart, capped at the CPU count;
+# 0 renders in-process), plus the bound on queued renders and how long to wait for a slot
+CHART_RENDER_WORKERS = os.getenv('CHART_RENDER_WORKERS', 'auto')
+CHART_RENDER_QUEUE = int(os.getenv('CHART_RENDER_QUEUE', 64))
+CHART_RENDER_TIMEOUT = float(os.getenv('CHART_RENDER_TIMEOUT', 30))
+
+# Processed-report cache: entry lifetime in seconds and maximum number of entries
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 7 * 24 * 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 10000))
+
+# Batch processing: per-stage worker pool sizes and the maximum items per request
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+BATCH_SCRAPE_WORKERS = int(os.getenv('BATCH_SCRAPE_WORKERS', 16))
+BATCH_HISTORY_WORKERS = int(os.getenv('BATCH_HISTORY_WORKERS', 2))
+BATCH_RENDER_WORKERS = int(os.getenv('BATCH_RENDER_WORKERS', 2))
+BATCH_UPLOAD_WORKERS = int(os.getenv('BATCH_UPLOAD_WORKERS', 16))
+BATCH_BITRIX_WORKERS = int(os.getenv('BATCH_BITRIX_WORKERS', 4))
+# Batch RPA updates are coalesced into Bitrix24 batch calls of up to 50 commands
+BITRIX_BATCH_SIZE = int(os.getenv('BITRIX_BATCH_SIZE', 50))
+BITRIX_BATCH_INTERVAL = float(os.getenv('BITRIX_BATCH_INTERVAL', 1.0))
+
+# Job queue: "inline" runs /webhook in the request, "job" queues it for the local workers
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'inline')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 5))
+
+# Bitrix24 OAuth tokens, shared by every worker: "sqlite" (one host) or "redis" (REDIS_URL),
+# refreshed this many seconds before expiry and re-read from the backend at most this often
+TOKEN_BACKEND = os.getenv('TOKEN_BACKEND', 'sqlite')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+TOKEN_REFRESH_MARGIN = float(os.getenv('TOKEN_REFRESH_MARGIN', 300))
+TOKEN_CACHE_SECONDS = float(os.getenv('TOKEN_CACHE_SECONDS', 30))
+
+# Exports: "stream" sends the file in the response, "job" writes it to DOWNLOAD_FOLDER in the background
+EXPORT_MODE = os.getenv('EXPORT_MODE', 'stream')
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
 # Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+os.makedirs(DATA_FOLDER, exist_ok=True)
+
+# Tokens are stored per portal, so every request and job for it shares one token
+BITRIX_TOKEN_KEY = urlsplit(BITRIX_API_URL).netloc
+if TOKEN_BACKEND == "redis":
+    token_backend = RedisTokenBackend.from_url(REDIS_URL)
+else:
+    token_backend = SQLiteTokenBackend(os.path.join(DATA_FOLDER, "tokens.sqlite3"))
+token_store = TokenStore(
+    token_backend,
+    request_token_refresh,
+    refresh_margin=TOKEN_REFRESH_MARGIN,
+    cache_seconds=TOKEN_CACHE_SECONDS,
+    # The refresh lease outlives the slowest refresh call twice over
+    lock_ttl=2 * sum(TOKEN_TIMEOUT),
+)
 
 @app.route('/oauth')
 def oauth():
@@ -108,151 +255,357 @@ def oauth():
     if not token_data or "access_token" not in token_data:
         return jsonify({"error": "Failed to retrieve access token"}), 400
 
-    # Store the access token in session
-    session['access_token'] = token_data["access_token"]
-    session['refresh_token'] = token_data["refresh_token"]
+    # Share the token with every worker
+    token_store.save(BITRIX_TOKEN_KEY, token_data)
 
     return jsonify({"message": "Bitrix24 Authentication Successful!"})
 
-# Google Cloud Storage client
-storage_client = storage.Client()
-
-def upload_to_gcs(file_path, destination_blob_name):
-    try:
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(destination_blob_name)
+# Chart storage: Google Cloud Storage, or a local directory standing in for it
+if UPLOAD_BACKEND == "local":
+    upload_backend = LocalBackend(LOCAL_UPLOAD_DIR, LOCAL_UPLOAD_BASE_URL)
+else:
+    storage_client = storage.Client()
+    upload_backend = GCSBackend(storage_client, GCS_BUCKET_NAME)
 
-        if not os.path.isfile(file_path):
-            logging.error(f"File not found: {file_path}")
-            return None
+chart_uploader = ChartUploader(
+    upload_backend,
+    workers=UPLOAD_WORKERS,
+    max_attempts=UPLOAD_MAX_ATTEMPTS,
+    backoff=UPLOAD_BACKOFF,
+)
 
-        blob.upload_from_filename(file_path)
-        return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{destination_blob_name}"
+def load_reference_data():
+    """WHO reference tables keyed like "bmifa_boys_per", from the bundle when it is current."""
+    tables, _ = load_reference_tables()
+    return tables
+
+reference_data, reference_data_version = load_reference_tables()
+logging.info(f"Loaded {len(reference_data)} reference tables (version {reference_data_version})")
+lms_engine = LMSEngine.from_reference_data(reference_data)
+
+# Optional JSON mapping of score keys (e.g. "bmifa_z") to Bitrix RPA field codes
+BITRIX_SCORE_FIELDS = json.loads(os.getenv("BITRIX_SCORE_FIELDS", "{}"))
+
+growth_history = GrowthHistory(os.path.join(DATA_FOLDER, "history.sqlite3"))
+
+# Cached results are only valid for the same reference data, chart settings and storage
+result_cache = ResultCache(
+    os.path.join(DATA_FOLDER, "results.sqlite3"),
+    version=data_version({
+        "reference_data": reference_data_version,
+        # Bumped when scoring or chart placement changes (whole-year ages are scored and plotted at mid-year)
+        "scoring": 3,
+        "chart_format": CHART_FORMAT,
+        "chart_dpi": CHART_DPI,
+        "chart_png_compress_level": CHART_PNG_COMPRESS_LEVEL,
+        "chart_png_palette": CHART_PNG_PALETTE,
+        "upload_backend": UPLOAD_BACKEND,
+        "gcs_bucket": GCS_BUCKET_NAME,
+    }),
+    ttl=RESULT_CACHE_TTL,
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+)
+
+def compute_growth_scores(gender_key, age, height, weight, bmi):
+    """WHO z-scores and percentiles for a child whose age is given in whole years (scored at mid-year)."""
+    scores = lms_engine.score_child(gender_key, age_in_months(age), bmi=bmi, height=height, weight=weight)
+    logging.info(f"Growth scores: {scores}")
+    return scores
 
-    except Exception as e:
-        logging.error(f"Error uploading to GCS: {e}")
+def extract_data_from_url(url):
+    try:
+        with timed(stage_seconds, stage_failures, stage="fetch"):
+            response = http.get(url)
+            response.raise_for_status()
+        with timed(stage_seconds, stage_failures, stage="parse"):
+            report = parse_report(response.content)
+        if report.missing:
+            logging.warning(f"Report {url} is missing fields: {', '.join(report.missing)}")
+        return report.as_text_dict()
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error extracting data from URL: {e}")
         return None
 
-def normalize_columns(dataframe):
-    column_mapping = {
-        "Year: Month": "Age (years)",
-        "Month": "Age (months)",
-        "3rd": "3rd Percentile",
-        "15th": "15th Percentile",
-        "50th": "50th Percentile",
-        "85th": "85th Percentile",
-        "97th": "97th Percentile",
-        "-3 SD": "-3SD Z-Scores",
-        "-2 SD": "-2SD Z-Scores",
-        "-1 SD": "-1SD Z-Scores",
-        "Median": "Median Z-Scores",
-        "1 SD": "1SD Z-Scores",
-        "2 SD": "2SD Z-Scores",
-        "3 SD": "3SD Z-Scores",
-        "3rdd": "3rd Z-Scores",
-        "15thh": "15th Z-Scores",
-        "Mediann": "Median Z Scores",
-        "85thh": "85th Z-Scores",
-        "97thh": "97th Z-Scores",
+chart_options = {
+    "fmt": CHART_FORMAT,
+    "dpi": CHART_DPI,
+    "compress_level": CHART_PNG_COMPRESS_LEVEL,
+    "palette": CHART_PNG_PALETTE,
+}
+chart_renderer = ChartRenderer(reference_data, cache_size=CHART_CACHE_SIZE, **chart_options)
+
+# Chart key -> (indicator, table kind, measurement, axis label, title)
+CHART_SPECS = {
+    "bmi_chart_per": ("bmifa", "per", "bmi", "BMI", "BMI Chart"),
+    "bmi_chart_z": ("bmifa", "z", "bmi", "BMI Z-Score", "BMI Z-Score Chart"),
+    "height_chart_per": ("hfa", "per", "height", "Height (cm)", "Height Chart"),
+    "height_chart_z": ("hfa", "z", "height", "Height Z-Score", "Height Z-Score Chart"),
+    "weight_chart_per": ("wfa", "per", "weight", "Weight (kg)", "Weight Chart"),
+    "weight_chart_z": ("wfa", "z", "weight", "Weight Z-Score", "Weight Z-Score Chart"),
+}
+
+if CHART_RENDER_WORKERS == 'auto':
+    cpus = os.cpu_count() or 1
+    render_workers = min(len(CHART_SPECS), cpus) if cpus > 1 else 0
+else:
+    render_workers = int(CHART_RENDER_WORKERS)
+
+render_pool = None
+if render_workers > 0:
+    render_pool = ChartRenderPool(
+        reference_data,
+        render_workers,
+        max_pending=CHART_RENDER_QUEUE,
+        submit_timeout=CHART_RENDER_TIMEOUT,
+        cache_size=CHART_CACHE_SIZE,
+        **chart_options,
+    )
+    atexit.register(render_pool.shutdown)
+
+def disable_render_pool():
+    global render_pool
+    pool, render_pool = render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+def parse_measurements(extracted_data):
+    """Convert the scraped report strings into the numbers used for charts and scores."""
+    def number(key):
+        value = parse_number(str(extracted_data.get(key, '0')))
+        if value is None:
+            raise ValueError(f"Report field {key} is not numeric: {extracted_data.get(key)!r}")
+        return value
+
+    return {
+        "age": int(number('age')),
+        "height": number('height'),
+        "weight": number('weight'),
+        "bmi": number('bmi'),
+        "gender_key": 'boys' if extracted_data.get('gender', '').lower() == 'male' else 'girls',
     }
-    dataframe.rename(columns=column_mapping, inplace=True)
-    if "Age (years)" in dataframe.columns:
-        dataframe["Age (years)"] = dataframe["Age (years)"].apply(parse_age)
-    return dataframe
-
-def parse_age(year_month):
-    try:
-        years, months = map(int, year_month.split(":"))
-        return years + (months / 12)
-    except ValueError:
-        return None
 
-def load_reference_data():
-    csv_files = {
-        "bmifa_boys_per": "csv_files/bmifa-boys-5-19years-per.csv",
-        "bmifa_boys_z": "csv_files/bmifa-boys-5-19years-z.csv",
-        "bmifa_girls_per": "csv_files/bmifa-girls-5-19years-per.csv",
-        "bmifa_girls_z": "csv_files/bmifa-girls-5-19years-z.csv",
-        "hfa_boys_per": "csv_files/hfa-boys-5-19years-per.csv",
-        "hfa_boys_z": "csv_files/sft-hfa-boys-perc-5-19years.csv",
-        "hfa_girls_per": "csv_files/hfa-girls-5-19years-per.csv",
-        "hfa_girls_z": "csv_files/sft-hfa-girls-perc-5-19years.csv",
-        "wfa_boys_per": "csv_files/wfa-boys-5-10years-per.csv",
-        "wfa_boys_z": "csv_files/wfa-boys-5-10years-z.csv",
-        "wfa_girls_per": "csv_files/wfa-girls-5-10years-per.csv",
-        "wfa_girls_z": "csv_files/wfa-girls-5-10years-z.csv",
+def generate_charts(measurements):
+    """Render all six growth charts for a child in memory, returning chart key -> bytes."""
+    # Plotted at the same mid-year age the scores and the history charts use
+    age = age_in_months(measurements["age"]) / 12
+    chart_args = {
+        key: (f'{indicator}_{measurements["gender_key"]}_{kind}', age, measurements[metric], metric_label, title)
+        for key, (indicator, kind, metric, metric_label, title) in CHART_SPECS.items()
     }
-    data = {}
-    for key, file_path in csv_files.items():
+    if render_pool is not None:
+        timings = {}
         try:
-            df = pd.read_csv(file_path)
-            df = normalize_columns(df)
-            data[key] = df
+            charts = render_pool.render_many(chart_args, timings)
+        except RenderPoolBusy:
+            raise
+        except BrokenProcessPool as e:
+            # A worker died (OOM kill, crash); forking a new pool from this threaded process
+            # is unsafe, so render in-process for the rest of this worker's life
+            logging.error(f"Render pool is broken, rendering in-process from now on: {e}")
+            disable_render_pool()
         except Exception as e:
-            logging.error(f"Error loading {file_path}: {e}")
-    return data
+            logging.error(f"Render pool failed, rendering in-process: {e}")
+        else:
+            for key, elapsed in timings.items():
+                chart_render_seconds.observe(elapsed, chart=key)
+            return charts
 
-reference_data = load_reference_data()
+    charts = {}
+    for key, args in chart_args.items():
+        try:
+            with timed(chart_render_seconds, chart=key):
+                charts[key] = chart_renderer.render(*args)
+        except Exception as e:
+            logging.error(f"Error rendering {key}: {e}")
+            charts[key] = None
+    return charts
+
+def generate_history_charts(history):
+    """Render all six growth charts with the child's trajectory through ``history`` (oldest first)."""
+    gender_key = history[-1]["gender_key"]
+    charts = {}
+    for key, (indicator, kind, metric, metric_label, title) in CHART_SPECS.items():
+        points = [(row["age_months"] / 12, row[metric]) for row in history if row[metric] is not None]
+        try:
+            charts[key] = chart_renderer.render_series(f'{indicator}_{gender_key}_{kind}', points, metric_label, title)
+        except Exception as e:
+            logging.error(f"Error rendering history {key}: {e}")
+            charts[key] = None
+    return charts
+
+def chart_objects(name, charts):
+    """Content-addressed object names for the rendered charts: chart key -> (name, bytes)."""
+    name_clean = name.replace(" ", "_")
+    return {
+        key: (content_address(f"{name_clean}_{key}", data, chart_renderer.fmt), data)
+        for key, data in charts.items()
+        if data is not None
+    }
 
-def extract_data_from_url(url):
-    try:
-        response = requests.get(url)
+def upload_charts(name, charts):
+    """Upload rendered charts concurrently, returning chart key -> public URL (None on failure)."""
+    uploaded = chart_uploader.upload_many(chart_objects(name, charts), content_type=chart_renderer.content_type)
+    return report_uploads(charts, uploaded)
+
+def report_uploads(charts, uploaded):
+    """Fill in None for charts that failed to upload, logging and counting each outcome."""
+    gcs_links = {key: None for key in charts}
+    gcs_links.update(uploaded)
+    for key in charts:
+        if gcs_links.get(key):
+            logging.info(f"Uploaded {key}: {gcs_links[key]}")
+        else:
+            logging.error(f"Failed to upload {key}")
+            chart_upload_failures.inc(chart=key)
+    return gcs_links
+
+def build_rpa_fields(extracted_data, measurements, link, gcs_links, scores):
+    """Map a processed report onto the Bitrix24 RPA item fields."""
+    fields = {
+        "UF_RPA_1_WEIGHT": measurements["weight"],
+        "UF_RPA_1_HEIGHT": measurements["height"],
+        "UF_RPA_1_1734279376": measurements["bmi"],
+        "UF_RPA_1_1734278050": measurements["age"],
+        "UF_RPA_1_1733491182": link,
+        "UF_RPA_1_1738508202": extracted_data.get("gender"),
+        "UF_RPA_1_1738508402": gcs_links.get("bmi_chart_per"),
+        "UF_RPA_1_1738508416": gcs_links.get("bmi_chart_z"),
+        "UF_RPA_1_1738508425": gcs_links.get("height_chart_per"),
+        "UF_RPA_1_1738508434": gcs_links.get("height_chart_z"),
+        "UF_RPA_1_1738508444": gcs_links.get("weight_chart_per"),
+        "UF_RPA_1_1738508458": gcs_links.get("weight_chart_z"),
+        "UF_RPA_1_1738508088": extracted_data.get("score"),
+        "UF_RPA_1_1738508230": extracted_data.get("ecf"),
+        "UF_RPA_1_1738508241": extracted_data.get("cf"),
+        "UF_RPA_1_1738508249": extracted_data.get("protein"),
+        "UF_RPA_1_1738508256": extracted_data.get("minerals"),
+        "UF_RPA_1_1738508263": extracted_data.get("fat"),
+        "UF_RPA_1_1738508271": extracted_data.get("body_water"),
+        "UF_RPA_1_1738508280": extracted_data.get("soft_lean_mass"),
+        "UF_RPA_1_1738508290": extracted_data.get("fat_free_mass"),
+        "UF_RPA_1_1738508302": extracted_data.get("smm"),
+        "UF_RPA_1_1738508319": extracted_data.get("body_fat_mass"),
+        "UF_RPA_1_1738508352": extracted_data.get("basal_metabolic_rate"),
+        "UF_RPA_1_1738508366": extracted_data.get("bone_mineral"),
+        "UF_RPA_1_1738508379": extracted_data.get("waist_hip_ratio"),
+        "UF_RPA_1_1738508390": extracted_data.get("visceral_fat_level"),
+        "UF_RPA_1_1738508329": extracted_data.get("pbf"),
+    }
+    for score_key, field_code in BITRIX_SCORE_FIELDS.items():
+        fields[field_code] = scores.get(score_key)
+    return fields
+
+def send_rpa_update_oauth(rpa_id, fields, access_token):
+    """Update an RPA item through the REST API with the user's OAuth token."""
+    target_url = f"{BITRIX_API_URL}rpa.item.update.json"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    with timed(stage_seconds, stage_failures, stage="bitrix"):
+        response = http.post(target_url, json={"id": rpa_id, "fields": fields}, headers=headers)
+    if response.status_code != 200:
+        stage_failures.inc(stage="bitrix")
+    return response
+
+def send_rpa_update_with_token(rpa_id, fields):
+    """send_rpa_update_oauth with the shared token, refreshing and retrying once if Bitrix24 rejects it."""
+    access_token = bitrix_access_token()
+    if not access_token:
+        raise RuntimeError("User not authenticated with Bitrix24")
+    response = send_rpa_update_oauth(rpa_id, fields, access_token)
+    if response.status_code == 401:
+        logging.warning("Access token rejected. Attempting to refresh...")
+        new_token = refresh_bitrix_token(stale=access_token)
+        if new_token:
+            response = send_rpa_update_oauth(rpa_id, fields, new_token)
+    return response
+
+def send_rpa_update(rpa_id, fields):
+    """Update an RPA item through the portal's inbound webhook (no OAuth token needed)."""
+    query_params = {"typeId": 1, "id": rpa_id}
+    for field_code, value in fields.items():
+        query_params[f"fields[{field_code}]"] = value
+    with timed(stage_seconds, stage_failures, stage="bitrix"):
+        response = http.post(BITRIX_RPA_UPDATE_URL, data=query_params)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        data_texts = soup.find_all("div", {"class": "data-text font-size-nom bold"})
-        box_texts = soup.find_all("div", {"class": "box"})
-        td_center_spans = soup.find_all("div", {"class": "td t-center", "style": "width:55%; text-align: right;"})
-
-        data = {
-            "name": soup.find("span", {"class": "name abs"}).text.strip() if soup.find("span", {"class": "name abs"}) else "Unknown",
-            "age": soup.find("span", {"class": "old abs"}).text.strip() if soup.find("span", {"class": "old abs"}) else "0",
-            "gender": soup.find("span", {"class": "sex abs"}).text.strip() if soup.find("span", {"class": "sex abs"}) else "Unknown",
-            "height": soup.find("span", {"class": "height abs"}).text.strip() if soup.find("span", {"class": "height abs"}) else "0 cm",
-            "weight": data_texts[0].text.strip() if len(data_texts) > 0 else "0",
-            "smm": data_texts[1].text.strip() if len(data_texts) > 1 else "0",
-            "bmi": data_texts[3].text.strip() if len(data_texts) > 3 else "0",
-            "pbf": data_texts[4].text.strip() if len(data_texts) > 4 else "0",
-            "score": box_texts[0].text.strip() if len(box_texts) > 0 else "0",
-            "ecf": soup.find_all("div", {"class": "bold"})[1].text.strip(),
-            "cf": soup.find_all("div", {"class": "bold"})[2].text.strip(),
-            "protein": soup.find_all("div", {"class": "bold"})[3].text.strip(),
-            "minerals": soup.find_all("div", {"class": "bold"})[4].text.strip(),
-            "fat": soup.find_all("div", {"class": "bold"})[5].text.strip(),
-            "body_water": soup.find_all("div", {"class": "bold"})[6].text.strip(),
-            "soft_lean_mass": soup.find_all("div", {"class": "bold"})[7].text.strip(),
-            "fat_free_mass": soup.find_all("div", {"class": "bold"})[8].text.strip(),
-            "body_fat_mass": data_texts[2].text.strip() if len(data_texts) > 2 else "0",
-            "basal_metabolic_rate": td_center_spans[0].find("span").text.strip() if len(td_center_spans) > 0 else "0",
-            "bone_mineral": td_center_spans[1].find("span").text.strip() if len(td_center_spans) > 1 else "0",
-            "waist_hip_ratio": td_center_spans[2].find("span").text.strip() if len(td_center_spans) > 2 else "0",
-            "visceral_fat_level": td_center_spans[3].find("span").text.strip() if len(td_center_spans) > 3 else "0",
-        }
-        return data
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error extracting data from URL: {e}")
+    return response
+
+class ReportUnavailable(ValueError):
+    """The report page could not be fetched or parsed."""
+
+# Keys of a processed report kept in the result cache and returned to callers
+RESULT_KEYS = ("extracted_data", "measurements", "scores", "gcs_links", "child_id")
+
+def report_result(context):
+    return {key: context.get(key) for key in RESULT_KEYS}
+
+def scrape_stage(context):
+    """Take the processed report from the cache, or scrape and score it."""
+    link = context["link"]
+    cached = result_cache.get(link)
+    if cached is not None:
+        logging.info(f"Result cache hit for {link}")
+        result, context["delivered"] = cached
+        # The caller's child_id/clinic win over the cached one; history_stage files the row
+        context.update({key: value for key, value in result.items() if key != "child_id"}, cached=True)
+        return
+    extracted_data = extract_data_from_url(link)
+    if not extracted_data:
+        raise ReportUnavailable("Failed to extract data from the provided link")
+    with timed(stage_seconds, stage_failures, stage="score"):
+        measurements = parse_measurements(extracted_data)
+        scores = compute_growth_scores(measurements["gender_key"], measurements["age"], measurements["height"], measurements["weight"], measurements["bmi"])
+    context.update(extracted_data=extracted_data, measurements=measurements, scores=scores, delivered=set())
+
+def history_stage(context):
+    # Runs on cache hits too: it re-files the row if the caller passed a new child_id or
+    # clinic, and otherwise reports the child_id the row is actually stored under
+    with timed(stage_seconds, stage_failures, stage="history"):
+        context["child_id"] = growth_history.record(
+            context["link"], context["extracted_data"], context["measurements"], context["scores"],
+            child_id=context.get("child_id"), clinic=context.get("clinic"),
+        )
+
+def render_stage(context):
+    if not context.get("cached"):
+        with timed(stage_seconds, stage_failures, stage="render"):
+            context["charts"] = generate_charts(context["measurements"])
+
+def upload_stage(context):
+    if not context.get("cached"):
+        with timed(stage_seconds, stage_failures, stage="upload"):
+            context["gcs_links"] = upload_charts(context["extracted_data"]["name"], context.pop("charts"))
+        cache_result(context["link"], report_result(context))
+
+# The one processing sequence behind /process, /webhook, webhook jobs, /batch and asgi.py:
+# (stage, progress message, function over the per-report context dict)
+REPORT_STAGES = [
+    ("scrape", "scraping", scrape_stage),
+    ("history", "recording history", history_stage),
+    ("render", "rendering charts", render_stage),
+    ("upload", "uploading charts", upload_stage),
+]
+
+def process_report(link, progress=lambda stage: None, child_id=None, clinic=None):
+    """Run REPORT_STAGES for one report, reusing the cached result when there is one.
+
+    Returns ``(result, delivered_keys)``, or None if the report could not be
+    extracted. ``result`` holds extracted_data, measurements, scores, gcs_links
+    and the child_id the measurement was recorded under in the growth history.
+    """
+    context = {"link": link, "child_id": child_id, "clinic": clinic}
+    try:
+        for _, message, stage in REPORT_STAGES:
+            if not context.get("cached"):
+                progress(message)
+            stage(context)
+    except ReportUnavailable:
         return None
+    return report_result(context), context["delivered"]
+
+def cache_result(link, result):
+    # Only complete results are reused; a failed upload is retried next time
+    if all(result["gcs_links"].values()):
+        result_cache.put(link, result)
 
-def plot_growth_chart(data, age, metric, metric_label, title, output_path):
-    try:
-        plt.figure(figsize=(6, 8))
-        for col in ["3rd Percentile", "15th Percentile", "50th Percentile", "85th Percentile", "97th Percentile", 
-                    "-3SD Z-Scores", "-2SD Z-Scores", "-1SD Z-Scores", "Median Z-Scores", 
-                    "1SD Z-Scores", "2SD Z-Scores", "3SD Z-Scores", "3rd Z-Scores", 
-                    "15th Z-Scores", "Median Z Scores", "85th Z-Scores", "97th Z-Scores"]:
-            if col in data.columns:
-                plt.plot(data["Age (years)"], data[col], label=col)
-
-        plt.scatter([age], [metric], color="red", label="Child's Data", zorder=5)
-        plt.title(title)
-        plt.xlabel("Age (years)")
-        plt.ylabel(metric_label)
-        plt.legend()
-        plt.grid(True)
-        plt.savefig(output_path)
-        plt.close()
-    except Exception as e:
-        logging.error(f"Error in plot_growth_chart: {e}")
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -262,6 +615,7 @@ def index():
     # ✅ Instead of JSON, always return the UI
     return render_template('index.html', BITRIX_CLIENT_ID=BITRIX_CLIENT_ID)
 
+
 @app.route('/process', methods=['POST'])
 def process():
     link = request.form.get('link')
@@ -271,79 +625,17 @@ def process():
         return render_template('index.html', error="Please provide both a valid link and RPA ID.")
 
     try:
-        extracted_data = extract_data_from_url(link)
-        if not extracted_data:
+        processed = process_report(link, child_id=request.form.get('child_id'), clinic=request.form.get('clinic'))
+        if not processed:
             return render_template('index.html', error="Failed to extract data from the provided link.")
 
-        age = int(extracted_data['age'])
-        height = float(extracted_data['height'].replace("cm", ""))
-        weight = float(extracted_data['weight'])
-        bmi = float(extracted_data['bmi'])
-
-        gender_key = 'boys' if extracted_data['gender'].lower() == 'male' else 'girls'
-
-        chart_paths = {
-            "bmi_chart_per": os.path.join(UPLOAD_FOLDER, "bmi_chart_per.png"),
-            "bmi_chart_z": os.path.join(UPLOAD_FOLDER, "bmi_chart_z.png"),
-            "height_chart_per": os.path.join(UPLOAD_FOLDER, "height_chart_per.png"),
-            "height_chart_z": os.path.join(UPLOAD_FOLDER, "height_chart_z.png"),
-            "weight_chart_per": os.path.join(UPLOAD_FOLDER, "weight_chart_per.png"),
-            "weight_chart_z": os.path.join(UPLOAD_FOLDER, "weight_chart_z.png")
-        }
-
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_per', pd.DataFrame()), age, bmi, "BMI", "BMI Chart", chart_paths["bmi_chart_per"])
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_z', pd.DataFrame()), age, bmi, "BMI Z-Score", "BMI Z-Score Chart", chart_paths["bmi_chart_z"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_per', pd.DataFrame()), age, height, "Height (cm)", "Height Chart", chart_paths["height_chart_per"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_z', pd.DataFrame()), age, height, "Height Z-Score", "Height Z-Score Chart", chart_paths["height_chart_z"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_per', pd.DataFrame()), age, weight, "Weight (kg)", "Weight Chart", chart_paths["weight_chart_per"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_z', pd.DataFrame()), age, weight, "Weight Z-Score", "Weight Z-Score Chart", chart_paths["weight_chart_z"])
-
-        gcs_links = {}
-        for key, path in chart_paths.items():
-            name_clean = extracted_data['name'].replace(" ", "_")
-            gcs_link = upload_to_gcs(path, f"{name_clean}_{key}.png")
-            if gcs_link:
-                logging.info(f"Uploaded {key}: {gcs_link}")
-            else:
-                logging.error(f"Failed to upload {key}")
-            gcs_links[key] = gcs_link
-
-        query_params = {
-            "typeId": 1,
-            "id": rpa_id,
-            "fields[UF_RPA_1_WEIGHT]": weight,
-            "fields[UF_RPA_1_HEIGHT]": height,
-            "fields[UF_RPA_1_1734279376]": bmi,
-            "fields[UF_RPA_1_1734278050]": age,
-            "fields[UF_RPA_1_1733491182]": link,
-            "fields[UF_RPA_1_1738508202]": extracted_data.get("gender"),
-            "fields[UF_RPA_1_1738508402]": gcs_links.get("bmi_chart_per"),
-            "fields[UF_RPA_1_1738508416]": gcs_links.get("bmi_chart_z"),
-            "fields[UF_RPA_1_1738508425]": gcs_links.get("height_chart_per"),
-            "fields[UF_RPA_1_1738508434]": gcs_links.get("height_chart_z"),
-            "fields[UF_RPA_1_1738508444]": gcs_links.get("weight_chart_per"),
-            "fields[UF_RPA_1_1738508458]": gcs_links.get("weight_chart_z"),
-            "fields[UF_RPA_1_1738508088]": extracted_data.get("score"),
-            "fields[UF_RPA_1_1738508230]": extracted_data.get("ecf"),
-            "fields[UF_RPA_1_1738508241]": extracted_data.get("cf"),
-            "fields[UF_RPA_1_1738508249]": extracted_data.get("protein"),
-            "fields[UF_RPA_1_1738508256]": extracted_data.get("minerals"),
-            "fields[UF_RPA_1_1738508263]": extracted_data.get("fat"),
-            "fields[UF_RPA_1_1738508271]": extracted_data.get("body_water"),
-            "fields[UF_RPA_1_1738508280]": extracted_data.get("soft_lean_mass"),
-            "fields[UF_RPA_1_1738508290]": extracted_data.get("fat_free_mass"),
-            "fields[UF_RPA_1_1738508302]": extracted_data.get("smm"),
-            "fields[UF_RPA_1_1738508319]": extracted_data.get("body_fat_mass"),
-            "fields[UF_RPA_1_1738508352]": extracted_data.get("basal_metabolic_rate"),
-            "fields[UF_RPA_1_1738508366]": extracted_data.get("bone_mineral"),
-            "fields[UF_RPA_1_1738508379]": extracted_data.get("waist_hip_ratio"),
-            "fields[UF_RPA_1_1738508390]": extracted_data.get("visceral_fat_level"),
-            "fields[UF_RPA_1_1738508329]": extracted_data.get("pbf")
-        }
+        result, delivered = processed
+        if delivery_key(WEBHOOK_TARGET, rpa_id) in delivered:
+            logging.info(f"Report {link} was already sent to RPA {rpa_id}; skipping the update")
+            return render_template('index.html', success="Data sent successfully to Bitrix24!")
 
-        target_url = "https://vitrah.bitrix24.com/rest/1/15urrpzalz7xkysu/rpa.item.update.json"
-        response = requests.post(target_url, data=query_params)
-        response.raise_for_status()
+        send_rpa_update(rpa_id, build_rpa_fields(result["extracted_data"], result["measurements"], link, result["gcs_links"], result["scores"]))
+        result_cache.mark_delivered(link, WEBHOOK_TARGET, rpa_id)
 
         return render_template('index.html', success="Data sent successfully to Bitrix24!")
     except requests.exceptions.RequestException as e:
@@ -356,35 +648,33 @@ def process():
 @app.route('/test_bitrix', methods=['GET'])
 def test_bitrix():
     """Test if the access token is working by fetching current user info from Bitrix24."""
-    if "access_token" not in session:
-        logging.warning("Access token not found, attempting refresh...")
-        new_token = refresh_bitrix_token()
-        if not new_token:
-            return jsonify({"error": "User not authenticated with Bitrix24"}), 401
+    access_token = bitrix_access_token()
+    if not access_token:
+        return jsonify({"error": "User not authenticated with Bitrix24"}), 401
 
-    access_token = session["access_token"]
-    url = f"https://cultiv.bitrix24.com/rest/user.current.json"
+    url = f"{BITRIX_API_URL}user.current.json"
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    response = requests.get(url, headers=headers)
+    response = http.get(url, headers=headers)
 
     # If access token is expired, refresh it
     if response.status_code == 401:
         logging.warning("Access token expired. Attempting to refresh...")
-        new_token = refresh_bitrix_token()
+        new_token = refresh_bitrix_token(stale=access_token)
         if not new_token:
             return jsonify({"error": "Failed to refresh token"}), 401
         headers["Authorization"] = f"Bearer {new_token}"
-        response = requests.get(url, headers=headers)  # Retry request
+        response = http.get(url, headers=headers)  # Retry request
 
     return response.json()
 
+
 @app.route('/webhook', methods=['POST', 'GET'])
 def webhook():
     """Handle incoming requests from Bitrix24 and update the RPA record."""
     try:
-        # Ensure the user is authenticated with Bitrix24
-        if "access_token" not in session:
+        # Ensure the app is authenticated with Bitrix24
+        if not bitrix_access_token():
             return jsonify({"status": "error", "message": "User not authenticated with Bitrix24"}), 401
 
         # Extract parameters from request
@@ -393,88 +683,36 @@ def webhook():
 
         if not link or not rpa_id:
             return jsonify({"status": "error", "message": "Missing required parameters: link and rpa_id"}), 400
-
-        # Extract child growth data
-        extracted_data = extract_data_from_url(link)
-        if not extracted_data:
+        child_id = request.args.get('child_id') or request.form.get('child_id')
+        clinic = request.args.get('clinic') or request.form.get('clinic')
+
+        # In job mode the work is queued and the caller polls /jobs/<id> instead of waiting
+        mode = request.args.get('mode') or request.form.get('mode') or WEBHOOK_MODE
+        if mode == "job":
+            job_id = job_queue.enqueue("webhook", {
+                "link": link, "rpa_id": rpa_id, "child_id": child_id, "clinic": clinic,
+            })
+            logging.info(f"Queued webhook job {job_id} for RPA {rpa_id}")
+            return jsonify({"status": "queued", "job_id": job_id, "status_url": url_for('job_status', job_id=job_id)}), 202
+
+        # Extract child growth data, generate growth charts and upload them (or reuse a cached result)
+        processed = process_report(link, child_id=child_id, clinic=clinic)
+        if not processed:
             return jsonify({"status": "error", "message": "Failed to extract data from the provided link"}), 400
 
-        age = int(extracted_data.get('age', 0))
-        height = float(extracted_data.get('height', '0').replace("cm", ""))
-        weight = float(extracted_data.get('weight', '0'))
-        bmi = float(extracted_data.get('bmi', '0'))
-        gender_key = 'boys' if extracted_data.get('gender', '').lower() == 'male' else 'girls'
-
-        # Generate growth charts
-        chart_paths = {
-            "bmi_chart_per": os.path.join(UPLOAD_FOLDER, "bmi_chart_per.png"),
-            "bmi_chart_z": os.path.join(UPLOAD_FOLDER, "bmi_chart_z.png"),
-            "height_chart_per": os.path.join(UPLOAD_FOLDER, "height_chart_per.png"),
-            "height_chart_z": os.path.join(UPLOAD_FOLDER, "height_chart_z.png"),
-            "weight_chart_per": os.path.join(UPLOAD_FOLDER, "weight_chart_per.png"),
-            "weight_chart_z": os.path.join(UPLOAD_FOLDER, "weight_chart_z.png")
-        }
-
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_per', pd.DataFrame()), age, bmi, "BMI", "BMI Chart", chart_paths["bmi_chart_per"])
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_z', pd.DataFrame()), age, bmi, "BMI Z-Score", "BMI Z-Score Chart", chart_paths["bmi_chart_z"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_per', pd.DataFrame()), age, height, "Height (cm)", "Height Chart", chart_paths["height_chart_per"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_z', pd.DataFrame()), age, height, "Height Z-Score", "Height Z-Score Chart", chart_paths["height_chart_z"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_per', pd.DataFrame()), age, weight, "Weight (kg)", "Weight Chart", chart_paths["weight_chart_per"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_z', pd.DataFrame()), age, weight, "Weight Z-Score", "Weight Z-Score Chart", chart_paths["weight_chart_z"])
-
-        # Upload charts to Google Cloud Storage
-        gcs_links = {}
-        for key, path in chart_paths.items():
-            name_clean = extracted_data['name'].replace(" ", "_")
-            gcs_link = upload_to_gcs(path, f"{name_clean}_{key}.png")
-            if gcs_link:
-                logging.info(f"Uploaded {key}: {gcs_link}")
-            else:
-                logging.error(f"Failed to upload {key}")
-            gcs_links[key] = gcs_link
-
-        # Prepare API request payload
-        query_params = {
-            "id": rpa_id,
-            "fields": {
-                "UF_RPA_1_WEIGHT": weight,
-                "UF_RPA_1_HEIGHT": height,
-                "UF_RPA_1_1734279376": bmi,
-                "UF_RPA_1_1734278050": age,
-                "UF_RPA_1_1733491182": link,
-                "UF_RPA_1_1738508202": extracted_data.get("gender"),
-                "UF_RPA_1_1738508402": gcs_links.get("bmi_chart_per"),
-                "UF_RPA_1_1738508416": gcs_links.get("bmi_chart_z"),
-                "UF_RPA_1_1738508425": gcs_links.get("height_chart_per"),
-                "UF_RPA_1_1738508434": gcs_links.get("height_chart_z"),
-                "UF_RPA_1_1738508444": gcs_links.get("weight_chart_per"),
-                "UF_RPA_1_1738508458": gcs_links.get("weight_chart_z"),
-                "UF_RPA_1_1738508088": extracted_data.get("score"),
-                "UF_RPA_1_1738508230": extracted_data.get("ecf"),
-                "UF_RPA_1_1738508241": extracted_data.get("cf"),
-                "UF_RPA_1_1738508249": extracted_data.get("protein"),
-                "UF_RPA_1_1738508256": extracted_data.get("minerals"),
-                "UF_RPA_1_1738508263": extracted_data.get("fat"),
-                "UF_RPA_1_1738508271": extracted_data.get("body_water"),
-                "UF_RPA_1_1738508280": extracted_data.get("soft_lean_mass"),
-                "UF_RPA_1_1738508290": extracted_data.get("fat_free_mass"),
-                "UF_RPA_1_1738508302": extracted_data.get("smm"),
-                "UF_RPA_1_1738508319": extracted_data.get("body_fat_mass"),
-                "UF_RPA_1_1738508352": extracted_data.get("basal_metabolic_rate"),
-                "UF_RPA_1_1738508366": extracted_data.get("bone_mineral"),
-                "UF_RPA_1_1738508379": extracted_data.get("waist_hip_ratio"),
-                "UF_RPA_1_1738508390": extracted_data.get("visceral_fat_level"),
-                "UF_RPA_1_1738508329": extracted_data.get("pbf"),
-            }
-        }
+        result, delivered = processed
+        scores = result["scores"]
+        if delivery_key(OAUTH_TARGET, rpa_id) in delivered:
+            logging.info(f"Report {link} was already sent to RPA {rpa_id}; skipping the update")
+            return jsonify({"status": "success", "message": "Data sent successfully to Bitrix24!", "scores": scores, "child_id": result.get("child_id")}), 200
 
         # Send request to Bitrix24 using OAuth token
-        target_url = f"{BITRIX_API_URL}rpa.item.update.json"
-        headers = {"Authorization": f"Bearer {session['access_token']}"}
-        response = requests.post(target_url, json=query_params, headers=headers)
+        fields = build_rpa_fields(result["extracted_data"], result["measurements"], link, result["gcs_links"], scores)
+        response = send_rpa_update_with_token(rpa_id, fields)
 
         if response.status_code == 200:
-            return jsonify({"status": "success", "message": "Data sent successfully to Bitrix24!"}), 200
+            result_cache.mark_delivered(link, OAUTH_TARGET, rpa_id)
+            return jsonify({"status": "success", "message": "Data sent successfully to Bitrix24!", "scores": scores, "child_id": result.get("child_id")}), 200
         else:
             logging.error(f"Bitrix24 API Error: {response.text}")
             return jsonify({"status": "error", "message": "Failed to send data", "details": response.text}), 500
@@ -488,5 +726,288 @@ def webhook():
         return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
 
 
+def run_webhook_job(payload, progress):
+    """Job-mode equivalent of /webhook: scrape, chart, upload and update Bitrix24."""
+    link, rpa_id = payload["link"], payload["rpa_id"]
+
+    processed = process_report(link, progress, child_id=payload.get("child_id"), clinic=payload.get("clinic"))
+    if not processed:
+        raise ValueError("Failed to extract data from the provided link")
+    result, delivered = processed
+
+    if delivery_key(OAUTH_TARGET, rpa_id) not in delivered:
+        progress("updating Bitrix24")
+        fields = build_rpa_fields(result["extracted_data"], result["measurements"], link, result["gcs_links"], result["scores"])
+        response = send_rpa_update_with_token(rpa_id, fields)
+        if response.status_code != 200:
+            raise RuntimeError(f"Bitrix24 API Error: {response.text}")
+        result_cache.mark_delivered(link, OAUTH_TARGET, rpa_id)
+
+    return {"rpa_id": rpa_id, "scores": result["scores"], "charts": result["gcs_links"], "child_id": result.get("child_id")}
+
+def run_export_job(payload, progress):
+    """Job-mode export: write the file into DOWNLOAD_FOLDER for /downloads to serve."""
+    path = os.path.join(DOWNLOAD_FOLDER, payload["filename"])
+    written = write_export(
+        growth_history, path, payload["format"], EXPORT_BATCH_SIZE,
+        progress=lambda written: progress(f"{written} bytes written"),
+        **payload["filters"],
+    )
+    return {"filename": payload["filename"], "bytes": written, "download_url": f"/downloads/{payload['filename']}"}
+
+job_queue = JobQueue(
+    os.path.join(DATA_FOLDER, "jobs.sqlite3"),
+    handlers={"webhook": run_webhook_job, "export": run_export_job},
+    workers=JOB_WORKERS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_delay=JOB_RETRY_DELAY,
+)
+job_queue.start()
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the progress and result of a queued job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+def _batch_bitrix(context):
+    if delivery_key(WEBHOOK_TARGET, context["rpa_id"]) in context.get("delivered", ()):
+        return
+    # Queue the update without waiting; run_batch_with_bitrix collects the outcome
+    fields = build_rpa_fields(context["extracted_data"], context["measurements"], context["link"], context["gcs_links"], context["scores"])
+    context["bitrix_future"] = bitrix_writer.submit(context["rpa_id"], fields)
+
+bitrix_writer = BitrixBatchWriter(
+    BITRIX_BATCH_URL, http, max_commands=BITRIX_BATCH_SIZE, flush_interval=BITRIX_BATCH_INTERVAL,
+)
+
+# REPORT_STAGES, each on its own pool, then the Bitrix24 update
+BATCH_WORKERS = {
+    "scrape": BATCH_SCRAPE_WORKERS,
+    "history": BATCH_HISTORY_WORKERS,
+    "render": BATCH_RENDER_WORKERS,
+    "upload": BATCH_UPLOAD_WORKERS,
+}
+BATCH_STAGES = [BatchStage(name, stage, workers=BATCH_WORKERS[name]) for name, _, stage in REPORT_STAGES]
+BATCH_STAGES.append(BatchStage("bitrix", _batch_bitrix, workers=BATCH_BITRIX_WORKERS))
+
+def run_batch_with_bitrix(items):
+    """Run items through BATCH_STAGES, then wait for their batched Bitrix24 updates."""
+    results = run_batch(items, BATCH_STAGES)
+    bitrix_writer.flush()
+    for result in results:
+        for stage, elapsed in result["timings"].items():
+            stage_seconds.observe(elapsed, stage=f"batch_{stage}")
+        if result.get("failed_stage"):
+            stage_failures.inc(stage=f"batch_{result['failed_stage']}")
+    for result in results:
+        future = result.pop("bitrix_future", None)
+        if future is None:
+            continue
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(f"Batch item {result['rpa_id']} failed at bitrix: {e}")
+            stage_failures.inc(stage="batch_bitrix")
+            result["status"] = "error"
+            result["failed_stage"] = "bitrix"
+            result["error"] = str(e)
+        else:
+            result_cache.mark_delivered(result["link"], WEBHOOK_TARGET, result["rpa_id"])
+    return results
+
+def parse_batch_items():
+    """Read link/rpa_id pairs (plus optional child_id and clinic) from a JSON body or an uploaded CSV file.
+
+    Returns an empty list when the body is malformed: not UTF-8 CSV, not a
+    list of objects, or a field of the wrong type.
+    """
+    if "file" in request.files:
+        try:
+            rows = list(csv.DictReader(io.StringIO(request.files["file"].read().decode("utf-8-sig"))))
+        except (UnicodeDecodeError, csv.Error) as e:
+            logging.error(f"Unreadable batch CSV: {e}")
+            return []
+    else:
+        payload = request.get_json(silent=True) or {}
+        rows = payload.get("items", []) if isinstance(payload, dict) else payload
+    if not isinstance(rows, list):
+        return []
+    items = []
+    for row in rows:
+        if not isinstance(row, dict):
+            return []
+        if not isinstance(row.get("link") or "", str) or not isinstance(row.get("rpa_id") or "", (str, int)):
+            return []
+        if not all(isinstance(row.get(field) or "", str) for field in ("child_id", "clinic")):
+            return []
+        link = (row.get("link") or "").strip()
+        rpa_id = "" if row.get("rpa_id") is None else str(row["rpa_id"]).strip()
+        if link and rpa_id:
+            items.append({"link": link, "rpa_id": rpa_id, "child_id": row.get("child_id") or None, "clinic": row.get("clinic") or None})
+    return items
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Process many InBody report links in one request."""
+    items = parse_batch_items()
+    if not items:
+        return jsonify({"status": "error", "message": "Provide link/rpa_id pairs as JSON items or a CSV file"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"status": "error", "message": f"Batch is limited to {BATCH_MAX_ITEMS} items"}), 400
+
+    results = run_batch_with_bitrix(items)
+    report = [
+        {
+            "link": result["link"],
+            "rpa_id": result["rpa_id"],
+            "status": result["status"],
+            "failed_stage": result.get("failed_stage"),
+            "error": result.get("error"),
+            "scores": result.get("scores"),
+            "child_id": result.get("child_id"),
+            "cached": result.get("cached", False),
+            "timings": result["timings"],
+        }
+        for result in results
+    ]
+    succeeded = sum(1 for result in report if result["status"] == "success")
+    logging.info(f"Batch finished: {succeeded}/{len(report)} succeeded")
+    return jsonify({"status": "success", "total": len(report), "succeeded": succeeded, "failed": len(report) - succeeded, "items": report}), 200
+
+
+@app.route('/history/<child_id>', methods=['GET'])
+@require_data_token
+def child_history(child_id):
+    """Return a child's recorded measurements, oldest first (``limit`` keeps the most recent)."""
+    limit = request.args.get('limit', type=int)
+    history = growth_history.child(child_id, limit=limit)
+    if not history:
+        return jsonify({"status": "error", "message": "No measurements recorded for this child"}), 404
+    return jsonify({"status": "success", "child_id": child_id, "total": len(history), "measurements": history}), 200
+
+@app.route('/history/<child_id>/charts', methods=['GET', 'POST'])
+@require_data_token
+def child_history_charts(child_id):
+    """Render and upload the six growth charts with the child's whole trajectory."""
+    limit = request.args.get('limit', type=int)
+    history = growth_history.child(child_id, limit=limit)
+    if not history:
+        return jsonify({"status": "error", "message": "No measurements recorded for this child"}), 404
+    try:
+        charts = generate_history_charts(history)
+        gcs_links = upload_charts(f"{history[-1]['name']}_history_{child_id}", charts)
+    except Exception as e:
+        logging.error(f"Failed to render history charts for {child_id}: {e}")
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+    return jsonify({"status": "success", "child_id": child_id, "points": len(history), "charts": gcs_links}), 200
+
+@app.route('/export', methods=['GET'])
+@require_data_token
+def export_measurements():
+    """Export recorded measurements and z-scores as CSV or Parquet, optionally filtered by clinic and time."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"Unsupported format; use one of {sorted(EXPORT_FORMATS)}"}), 400
+    try:
+        filters = {
+            "clinic": request.args.get('clinic'),
+            "since": parse_time(request.args.get('since')),
+            "until": parse_time(request.args.get('until')),
+        }
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid since/until: {e}"}), 400
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    # Unguessable, since job-mode files stay in DOWNLOAD_FOLDER
+    filename = f"measurements_{int(time.time())}_{secrets.token_hex(16)}.{extension}"
+
+    # Large exports can be written by the job workers instead of holding this request open
+    mode = request.args.get('mode') or EXPORT_MODE
+    if mode == "job":
+        job_id = job_queue.enqueue("export", {"format": fmt, "filters": filters, "filename": filename})
+        return jsonify({"status": "queued", "job_id": job_id, "status_url": url_for('job_status', job_id=job_id)}), 202
+
+    try:
+        chunks = iter_export(growth_history, fmt, EXPORT_BATCH_SIZE, **filters)
+        first = next(chunks, b"")
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    def stream():
+        yield first
+        yield from chunks
+
+    return Response(stream(), mimetype=content_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route('/downloads/<path:filename>', methods=['GET'])
+@require_data_token
+def download(filename):
+    """Serve a finished export from DOWNLOAD_FOLDER."""
+    return send_from_directory(os.path.abspath(DOWNLOAD_FOLDER), filename, as_attachment=True)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    if PROFILE_TOKEN and request.headers.get('X-Profile') == PROFILE_TOKEN and profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_lock.release()
+        # Only this request's thread is profiled; pool and job workers show up as waits
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        filename = f"{request.endpoint or 'unknown'}_{int(time.time() * 1000)}_{os.getpid()}.prof"
+        profiler.dump_stats(os.path.join(PROFILE_FOLDER, filename))
+        response.headers['X-Profile-File'] = filename
+    started = g.pop('request_started', None)
+    if started is not None:
+        request_seconds.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code,
+        )
+    return response
+
+@app.teardown_request
+def stop_abandoned_profiler(exc):
+    # after_request is skipped when an exception propagates; never leave the profiler running
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_lock.release()
+
+@metrics.collector
+def collect_cache_and_http_metrics():
+    caches = {"result": result_cache, "chart": chart_renderer.cache}
+    if render_pool is not None:
+        caches["chart_pool"] = render_pool.cache
+    http_stats = http.stats()
+    return [
+        ("growth_cache_hits_total", "counter", "Cache lookups that found an entry",
+         [({"cache": name}, cache.hits) for name, cache in caches.items()]),
+        ("growth_cache_misses_total", "counter", "Cache lookups that found nothing",
+         [({"cache": name}, cache.misses) for name, cache in caches.items()]),
+        ("growth_http_requests_total", "counter", "Outbound HTTP requests per host",
+         [({"host": host}, stats["requests"]) for host, stats in http_stats.items()]),
+        ("growth_http_errors_total", "counter", "Outbound HTTP requests per host that failed or returned >= 400",
+         [({"host": host}, stats["errors"]) for host, stats in http_stats.items()]),
+        ("growth_http_seconds_total", "counter", "Time spent in outbound HTTP requests per host",
+         [({"host": host}, stats["total_seconds"]) for host, stats in http_stats.items()]),
+    ]
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of this process's metrics."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
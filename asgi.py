@@ -0,0 +1,249 @@
+"""ASGI entry point with async /webhook and /process; every other route is the Flask app.
+
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+A sync worker is pinned by each request while it waits on the report host,
+GCS and Bitrix24. Here those two routes run on the event loop: each of
+app.REPORT_STAGES goes to a bounded thread pool, chart rendering to its own
+executor (which feeds the render process pool when there is one), so one
+worker keeps dozens of webhooks in flight. Routes and responses match the
+Flask views, and response headers pass through Flask's after_request hooks
+(CORS). Requests asking for a profile (X-Profile) are served by the Flask
+views, where the profiler runs.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from asgiref.wsgi import WsgiToAsgi
+from flask import render_template, request, url_for
+from werkzeug.test import EnvironBuilder
+
+import app as web
+from result_cache import delivery_key
+
+# Threads for blocking I/O (fetch, uploads, Bitrix24, SQLite) and for chart rendering
+ASYNC_IO_WORKERS = int(os.getenv('ASYNC_IO_WORKERS', 64))
+ASYNC_RENDER_WORKERS = int(os.getenv('ASYNC_RENDER_WORKERS', max(2, web.render_workers)))
+
+io_executor = ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix="async-io")
+render_executor = ThreadPoolExecutor(max_workers=ASYNC_RENDER_WORKERS, thread_name_prefix="async-render")
+
+wsgi_application = WsgiToAsgi(web.app)
+
+
+def run_io(func, *args, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+
+def run_render(func, *args, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(render_executor, functools.partial(func, *args, **kwargs))
+
+
+def _environ(scope, body):
+    return EnvironBuilder(
+        path=scope["path"],
+        method=scope["method"],
+        query_string=scope["query_string"].decode("latin-1"),
+        headers=[(name.decode("latin-1"), value.decode("latin-1")) for name, value in scope["headers"]],
+        data=body,
+    ).get_environ()
+
+
+def in_request_context(scope, body, func):
+    """Run ``func()`` inside a Flask request context for this ASGI request (form, args, url_for)."""
+    with web.app.request_context(_environ(scope, body)):
+        return func()
+
+
+async def process_report_async(link, child_id=None, clinic=None):
+    """Async driver of app.REPORT_STAGES, with the same return value as app.process_report."""
+    context = {"link": link, "child_id": child_id, "clinic": clinic}
+    try:
+        for name, _, stage in web.REPORT_STAGES:
+            await (run_render if name == "render" else run_io)(stage, context)
+    except web.ReportUnavailable:
+        return None
+    return web.report_result(context), context["delivered"]
+
+
+def flask_headers(scope, body, status, headers):
+    """``headers`` for an async response after Flask's after_request hooks (CORS) have run on it."""
+    def process():
+        response = web.app.response_class(status=status, headers=[
+            (name.decode("latin-1"), value.decode("latin-1")) for name, value in headers
+        ])
+        response = web.app.process_response(response)
+        return [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+    return in_request_context(scope, body, process)
+
+
+async def send_response(send, status, body, content_type, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, payload, status=200):
+    await send_response(send, status, json.dumps(payload).encode(), "application/json")
+
+
+async def webhook(scope, body, send):
+    """Async /webhook: same parameters, job mode and JSON responses as app.webhook."""
+    def read_params():
+        return {
+            "link": request.args.get('link') or request.form.get('link'),
+            "rpa_id": request.args.get('rpa_id') or request.form.get('rpa_id'),
+            "child_id": request.args.get('child_id') or request.form.get('child_id'),
+            "clinic": request.args.get('clinic') or request.form.get('clinic'),
+            "mode": request.args.get('mode') or request.form.get('mode') or web.WEBHOOK_MODE,
+        }
+
+    try:
+        params = await run_io(in_request_context, scope, body, read_params)
+        if not await run_io(web.bitrix_access_token):
+            return await send_json(send, {"status": "error", "message": "User not authenticated with Bitrix24"}, 401)
+        link, rpa_id = params["link"], params["rpa_id"]
+        if not link or not rpa_id:
+            return await send_json(send, {"status": "error", "message": "Missing required parameters: link and rpa_id"}, 400)
+
+        if params["mode"] == "job":
+            job_id = await run_io(web.job_queue.enqueue, "webhook", {
+                "link": link, "rpa_id": rpa_id, "child_id": params["child_id"], "clinic": params["clinic"],
+            })
+            logging.info(f"Queued webhook job {job_id} for RPA {rpa_id}")
+            status_url = await run_io(in_request_context, scope, body, lambda: url_for('job_status', job_id=job_id))
+            return await send_json(send, {"status": "queued", "job_id": job_id, "status_url": status_url}, 202)
+
+        processed = await process_report_async(link, child_id=params["child_id"], clinic=params["clinic"])
+        if not processed:
+            return await send_json(send, {"status": "error", "message": "Failed to extract data from the provided link"}, 400)
+
+        result, delivered = processed
+        scores = result["scores"]
+        success = {"status": "success", "message": "Data sent successfully to Bitrix24!", "scores": scores, "child_id": result.get("child_id")}
+        if delivery_key(web.OAUTH_TARGET, rpa_id) in delivered:
+            logging.info(f"Report {link} was already sent to RPA {rpa_id}; skipping the update")
+            return await send_json(send, success)
+
+        fields = web.build_rpa_fields(result["extracted_data"], result["measurements"], link, result["gcs_links"], scores)
+        response = await run_io(web.send_rpa_update_with_token, rpa_id, fields)
+        if response.status_code == 200:
+            await run_io(web.result_cache.mark_delivered, link, web.OAUTH_TARGET, rpa_id)
+            return await send_json(send, success)
+        logging.error(f"Bitrix24 API Error: {response.text}")
+        return await send_json(send, {"status": "error", "message": "Failed to send data", "details": response.text}, 500)
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to send data: {str(e)}")
+        return await send_json(send, {"status": "error", "message": f"Failed to send data: {str(e)}"}, 500)
+    except Exception as e:
+        logging.error(f"Unexpected error: {str(e)}")
+        return await send_json(send, {"status": "error", "message": f"An unexpected error occurred: {str(e)}"}, 500)
+
+
+async def process(scope, body, send):
+    """Async /process: same form fields and rendered page as app.process."""
+    async def page(**context):
+        html = await run_io(in_request_context, scope, body, lambda: render_template('index.html', **context))
+        await send_response(send, 200, html.encode(), "text/html; charset=utf-8")
+
+    form = await run_io(in_request_context, scope, body, lambda: request.form.to_dict())
+    link, rpa_id = form.get('link'), form.get('rpa_id')
+    if not link or not rpa_id:
+        return await page(error="Please provide both a valid link and RPA ID.")
+
+    try:
+        processed = await process_report_async(link, child_id=form.get('child_id'), clinic=form.get('clinic'))
+        if not processed:
+            return await page(error="Failed to extract data from the provided link.")
+
+        result, delivered = processed
+        if delivery_key(web.WEBHOOK_TARGET, rpa_id) not in delivered:
+            fields = web.build_rpa_fields(result["extracted_data"], result["measurements"], link, result["gcs_links"], result["scores"])
+            await run_io(web.send_rpa_update, rpa_id, fields)
+            await run_io(web.result_cache.mark_delivered, link, web.WEBHOOK_TARGET, rpa_id)
+        else:
+            logging.info(f"Report {link} was already sent to RPA {rpa_id}; skipping the update")
+        return await page(success="Data sent successfully to Bitrix24!")
+    except requests.exceptions.RequestException as e:
+        message = e.response.text if e.response else str(e)
+        logging.error(f"Failed to send data: {message}")
+        return await page(error=f"Failed to send data: {message}")
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+        return await page(error=f"An unexpected error occurred: {str(e)}")
+
+
+# Path -> (methods, handler) served on the event loop
+ASYNC_ROUTES = {
+    "/webhook": (("GET", "POST"), webhook),
+    "/process": (("POST",), process),
+}
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            io_executor.shutdown(wait=False)
+            render_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def wants_profile(scope):
+    return bool(web.PROFILE_TOKEN) and any(
+        name == b"x-profile" and value.decode("latin-1") == web.PROFILE_TOKEN for name, value in scope["headers"]
+    )
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    route = ASYNC_ROUTES.get(scope.get("path")) if scope["type"] == "http" else None
+    if route is None or scope["method"] not in route[0] or wants_profile(scope):
+        return await wsgi_application(scope, receive, send)
+
+    started = time.perf_counter()
+    statuses = []
+
+    body = await read_body(receive)
+
+    async def send_and_record(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+            headers = await run_io(flask_headers, scope, body, message["status"], message["headers"])
+            message = dict(message, headers=headers)
+        await send(message)
+
+    try:
+        await route[1](scope, body, send_and_record)
+    finally:
+        web.request_seconds.observe(
+            time.perf_counter() - started,
+            endpoint=scope["path"].strip("/"), method=scope["method"], status=statuses[0] if statuses else 500,
+        )
@@ -0,0 +1,72 @@
+"""Fan a batch of report items out over bounded per-stage worker pools."""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BatchStage:
+    """One pipeline stage: ``func(context)`` runs on a pool of ``workers`` threads."""
+
+    def __init__(self, name, func, workers=4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+def run_batch(items, stages):
+    """Run every item through ``stages`` in order and return one context per item.
+
+    Each stage owns its own bounded pool and an item moves on as soon as it
+    clears the previous stage, so the stages overlap and total wall time is
+    governed by the slowest stage's throughput rather than the sum of every
+    item's round trips. A stage function reads and mutates the per-item
+    context dict; an exception stops that item and is recorded on it.
+    """
+    contexts = [dict(item, status="pending", timings={}) for item in items]
+    if not contexts:
+        return contexts
+
+    remaining = [len(contexts)]
+    lock = threading.Lock()
+    done = threading.Event()
+    pools = [
+        ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=f"batch-{stage.name}")
+        for stage in stages
+    ]
+
+    def finish(context):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    def run_stage(context, stage_index):
+        stage = stages[stage_index]
+        started = time.perf_counter()
+        try:
+            stage.func(context)
+        except Exception as e:
+            logging.error(f"Batch item {context.get('rpa_id')} failed at {stage.name}: {e}")
+            context["status"] = "error"
+            context["failed_stage"] = stage.name
+            context["error"] = str(e)
+            finish(context)
+            return
+        finally:
+            context["timings"][stage.name] = round(time.perf_counter() - started, 3)
+
+        if stage_index + 1 < len(stages):
+            pools[stage_index + 1].submit(run_stage, context, stage_index + 1)
+        else:
+            context["status"] = "success"
+            finish(context)
+
+    try:
+        for context in contexts:
+            pools[0].submit(run_stage, context, 0)
+        done.wait()
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True)
+    return contexts
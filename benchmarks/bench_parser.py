@@ -0,0 +1,102 @@
+"""Micro-benchmark of InBody report parsing against the saved fixtures.
+
+Run from the repository root:
+
+    python benchmarks/bench_parser.py [--repeat 200]
+
+Reports the mean and best parse time per report for the original
+multi-scan BeautifulSoup extraction and for each single-pass backend.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inbody  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "*.html")
+
+
+def legacy_parse(content):
+    """The extraction app.py used before the single-pass parser, kept as the baseline."""
+    soup = BeautifulSoup(content, 'html.parser')
+    data_texts = soup.find_all("div", {"class": "data-text font-size-nom bold"})
+    box_texts = soup.find_all("div", {"class": "box"})
+    td_center_spans = soup.find_all("div", {"class": "td t-center", "style": "width:55%; text-align: right;"})
+    return {
+        "name": soup.find("span", {"class": "name abs"}).text.strip() if soup.find("span", {"class": "name abs"}) else "Unknown",
+        "age": soup.find("span", {"class": "old abs"}).text.strip() if soup.find("span", {"class": "old abs"}) else "0",
+        "gender": soup.find("span", {"class": "sex abs"}).text.strip() if soup.find("span", {"class": "sex abs"}) else "Unknown",
+        "height": soup.find("span", {"class": "height abs"}).text.strip() if soup.find("span", {"class": "height abs"}) else "0 cm",
+        "weight": data_texts[0].text.strip() if len(data_texts) > 0 else "0",
+        "smm": data_texts[1].text.strip() if len(data_texts) > 1 else "0",
+        "bmi": data_texts[3].text.strip() if len(data_texts) > 3 else "0",
+        "pbf": data_texts[4].text.strip() if len(data_texts) > 4 else "0",
+        "score": box_texts[0].text.strip() if len(box_texts) > 0 else "0",
+        "ecf": soup.find_all("div", {"class": "bold"})[1].text.strip(),
+        "cf": soup.find_all("div", {"class": "bold"})[2].text.strip(),
+        "protein": soup.find_all("div", {"class": "bold"})[3].text.strip(),
+        "minerals": soup.find_all("div", {"class": "bold"})[4].text.strip(),
+        "fat": soup.find_all("div", {"class": "bold"})[5].text.strip(),
+        "body_water": soup.find_all("div", {"class": "bold"})[6].text.strip(),
+        "soft_lean_mass": soup.find_all("div", {"class": "bold"})[7].text.strip(),
+        "fat_free_mass": soup.find_all("div", {"class": "bold"})[8].text.strip(),
+        "body_fat_mass": data_texts[2].text.strip() if len(data_texts) > 2 else "0",
+        "basal_metabolic_rate": td_center_spans[0].find("span").text.strip() if len(td_center_spans) > 0 else "0",
+        "bone_mineral": td_center_spans[1].find("span").text.strip() if len(td_center_spans) > 1 else "0",
+        "waist_hip_ratio": td_center_spans[2].find("span").text.strip() if len(td_center_spans) > 2 else "0",
+        "visceral_fat_level": td_center_spans[3].find("span").text.strip() if len(td_center_spans) > 3 else "0",
+    }
+
+
+def parsers():
+    yield "legacy-bs4", legacy_parse
+    yield "single-pass-bs4", lambda content: inbody.parse_report(content, backend="bs4").as_text_dict()
+    if inbody.lxml is not None:
+        yield "single-pass-lxml", lambda content: inbody.parse_report(content, backend="lxml").as_text_dict()
+
+
+def time_parser(parse, content, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(content)
+        samples.append(time.perf_counter() - started)
+    return sum(samples) / len(samples), min(samples)
+
+
+def run(repeat):
+    """Return one result dict per (fixture, parser)."""
+    results = []
+    for path in sorted(glob.glob(FIXTURES)):
+        with open(path, "rb") as f:
+            content = f.read()
+        expected = legacy_parse(content)
+        for name, parse in parsers():
+            if parse(content) != expected:
+                raise AssertionError(f"{name} disagrees with the legacy parser on {os.path.basename(path)}")
+            mean, best = time_parser(parse, content, repeat)
+            results.append({
+                "fixture": os.path.basename(path),
+                "parser": name,
+                "mean_ms": round(mean * 1000, 3),
+                "best_ms": round(best * 1000, 3),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+    for result in run(args.repeat):
+        print(f"{result['fixture']:<28} {result['parser']:<18} mean {result['mean_ms']:>8.3f} ms  best {result['best_ms']:>8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
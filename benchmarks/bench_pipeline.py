@@ -0,0 +1,301 @@
+"""End-to-end benchmark of the processing pipeline against local stub servers.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py [--requests 60] [--concurrency 1,4,16] [--compare benchmarks/results/<older>.json]
+
+The report host, Bitrix24 and GCS are replaced by the stubs in stubs.py
+(--upload-backend local writes charts to disk instead), so nothing leaves
+the machine.
+Every scenario reports latency percentiles and throughput; the run is saved
+as JSON under benchmarks/results/ (named by time and git commit) so two
+commits can be compared with --compare.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_parser  # noqa: E402
+from stubs import BitrixHandler, FakeRedis, GCSHandler, ReportHandler, StubServer  # noqa: E402
+
+
+def summarize(name, latencies, elapsed, concurrency, errors=0):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 2),
+    }
+
+
+def measure(name, func, count, concurrency=1):
+    """Call ``func(i)`` for i in range(count) on ``concurrency`` threads; func returns truthy on success."""
+    latencies = [0.0] * count
+    failures = [0]
+    lock = threading.Lock()
+
+    def call(i):
+        started = time.perf_counter()
+        try:
+            ok = func(i)
+        except Exception:
+            ok = False
+        latencies[i] = time.perf_counter() - started
+        if not ok:
+            with lock:
+                failures[0] += 1
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        for i in range(count):
+            call(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(call, range(count)))
+    return summarize(name, latencies, time.perf_counter() - started, concurrency, failures[0])
+
+
+def token_scenarios(workdir, args):
+    """TokenStore reads and racing refreshes over SQLite and over RedisTokenBackend(FakeRedis())."""
+    from tokens import RedisTokenBackend, SQLiteTokenBackend, TokenStore
+
+    results = []
+    backends = {
+        "sqlite": SQLiteTokenBackend(os.path.join(workdir, "tokens.sqlite3")),
+        "redis": RedisTokenBackend(FakeRedis()),
+    }
+    for name, backend in backends.items():
+        refreshes = [0]
+        lock = threading.Lock()
+
+        def refresh(refresh_token):
+            time.sleep(0.05)  # the provider's round trip
+            with lock:
+                refreshes[0] += 1
+                count = refreshes[0]
+            return {"access_token": f"access-{count}", "refresh_token": f"refresh-{count}", "expires_in": 3600}
+
+        store = TokenStore(backend, refresh)
+        store.save("bench", {"access_token": "access-0", "refresh_token": "refresh-0", "expires_in": 3600})
+        results.append(measure(f"token_read[{name}]", lambda i: store.access_token("bench"), args.repeat * 50))
+        uncached = TokenStore(backend, refresh, cache_seconds=0)
+        results.append(measure(f"token_read[{name},uncached]", lambda i: uncached.access_token("bench"), args.repeat * 50))
+
+        # Separate stores stand in for separate workers racing a token inside the refresh margin;
+        # single-flight refreshing means one provider call between them
+        store.save("bench", {"access_token": "access-0", "refresh_token": "refresh-0", "expires_in": 60})
+        workers = [TokenStore(backend, refresh, cache_seconds=0) for _ in range(4)]
+        result = measure(f"token_refresh[{name}]", lambda i: workers[i % len(workers)].access_token("bench"), 32, concurrency=16)
+        result["provider_refreshes"] = refreshes[0]
+        results.append(result)
+    return results
+
+
+def configure_environment(workdir, report_stub, bitrix_stub, gcs_stub, args):
+    """Point the app at the stubs and a scratch directory before it is imported."""
+    os.environ.update({
+        "DATA_FOLDER": os.path.join(workdir, "data"),
+        "DOWNLOAD_FOLDER": os.path.join(workdir, "downloads"),
+        "UPLOAD_BACKEND": args.upload_backend,
+        "LOCAL_UPLOAD_DIR": os.path.join(workdir, "charts"),
+        "STORAGE_EMULATOR_HOST": gcs_stub.url.rstrip("/"),
+        "GOOGLE_CLOUD_PROJECT": "benchmark",
+        "BITRIX_WEBHOOK_URL": f"{bitrix_stub.url}rest/1/benchmark/",
+        "BITRIX_API_URL": f"{bitrix_stub.url}rest/",
+        "BITRIX_RATE_LIMIT": str(args.bitrix_rate),
+        "BITRIX_RATE_BURST": str(max(1, int(args.bitrix_rate))),
+        "HTTP_MAX_RETRIES": "0",
+    })
+    # Anything still written relative to the working directory lands in the scratch directory
+    os.chdir(workdir)
+
+
+def run(args):
+    results = []
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+
+    for result in bench_parser.run(args.parser_repeat):
+        results.append({"scenario": f"parse[{result['parser']}]", "fixture": result["fixture"],
+                        "mean_ms": result["mean_ms"], "best_ms": result["best_ms"]})
+
+    report_stub = StubServer(ReportHandler, latency=args.report_latency / 1000).start()
+    bitrix_stub = StubServer(BitrixHandler, latency=args.bitrix_latency / 1000).start()
+    gcs_stub = StubServer(GCSHandler, latency=args.gcs_latency / 1000).start()
+    workdir = tempfile.mkdtemp(prefix="growth-bench-")
+    configure_environment(workdir, report_stub, bitrix_stub, gcs_stub, args)
+    results.extend(token_scenarios(workdir, args))
+
+    started = time.perf_counter()
+    import app  # noqa: E402  (configured by the environment above)
+    results.append({"scenario": "import_app", "mean_ms": round((time.perf_counter() - started) * 1000, 3)})
+
+    results.append(measure("load_reference_data", lambda i: app.load_reference_data(), args.repeat))
+    from reference_bundle import load_csv_tables
+    results.append(measure("load_reference_data[csv]", lambda i: load_csv_tables(), max(1, args.repeat // 4)))
+
+    fixtures = sorted(ReportHandler.fixtures)
+    # /webhook needs the portal to be authorized, as if /oauth had run
+    app.token_store.save(app.BITRIX_TOKEN_KEY, {"access_token": "benchmark-token", "refresh_token": "benchmark-refresh", "expires_in": 3600})
+
+    def report_url(i, scenario):
+        # Unique per request so the result cache and history never short-circuit the work
+        return f"{report_stub.url}reports/{fixtures[i % len(fixtures)]}?run={scenario}-{i}"
+
+    measurements = app.parse_measurements(app.extract_data_from_url(report_url(0, "warmup")))
+    app.generate_charts(measurements)
+    results.append(measure("render_charts[warm]", lambda i: all(app.generate_charts(measurements).values()), args.repeat))
+
+    def render_cold(i):
+        # A different weight per call misses every chart cache
+        return all(app.generate_charts(dict(measurements, weight=measurements["weight"] + (i + 1) / 1000)).values())
+    results.append(measure("render_charts[cold]", render_cold, args.repeat))
+
+    for concurrency in concurrency_levels:
+        scenario = f"extract_data_from_url[c{concurrency}]"
+        results.append(measure(scenario, lambda i, s=scenario: app.extract_data_from_url(report_url(i, s)) is not None,
+                               args.requests, concurrency))
+
+    clients = threading.local()
+
+    def client():
+        if not hasattr(clients, "client"):
+            clients.client = app.app.test_client()
+        return clients.client
+
+    def process(link, rpa_id):
+        response = client().post("/process", data={"link": link, "rpa_id": rpa_id})
+        # /process renders errors into the page with a 200
+        return response.status_code == 200 and b"alert-danger" not in response.data
+
+    def webhook(link, rpa_id):
+        return client().post("/webhook", data={"link": link, "rpa_id": rpa_id}).status_code == 200
+
+    for concurrency in concurrency_levels:
+        for name, send in (("process", process), ("webhook", webhook)):
+            scenario = f"{name}[c{concurrency}]"
+            results.append(measure(scenario, lambda i, s=scenario, send=send: send(report_url(i, s), str(i + 1)),
+                                   args.requests, concurrency))
+
+    cached_link = report_url(0, "cached")
+    webhook(cached_link, "1")
+    results.append(measure("webhook[cached]", lambda i: webhook(cached_link, "1"), args.requests))
+
+    def batch(i):
+        items = [{"link": report_url(i * args.batch_size + j, "batch"), "rpa_id": str(j + 1)} for j in range(args.batch_size)]
+        response = client().post("/batch", json={"items": items})
+        return response.status_code == 200 and response.json["succeeded"] == len(items)
+    results.append(measure(f"batch[{args.batch_size}]", batch, max(1, args.requests // args.batch_size)))
+
+    # Create-if-absent against the storage backend: a new object, then the same name again
+    def put_new(i):
+        return app.upload_backend.put_if_absent(f"bench-new-{i}.png", b"chart", "image/png")
+    results.append(measure(f"put_if_absent[{args.upload_backend},new]", put_new, args.requests))
+    results.append(measure(f"put_if_absent[{args.upload_backend},existing]",
+                           lambda i: not app.upload_backend.put_if_absent("bench-new-0.png", b"chart", "image/png"), args.requests))
+
+    report_stub.stop()
+    bitrix_stub.stop()
+    gcs_stub.stop()
+    return results, {"report_requests": report_stub.requests, "bitrix_requests": bitrix_stub.requests,
+                     "gcs_requests": gcs_stub.requests}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save(results, stubs, args):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = git_commit()
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{commit}.json")
+    with open(path, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created_at": stamp,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "arguments": vars(args),
+            "stub_requests": stubs,
+            "results": results,
+        }, f, indent=2)
+    return path
+
+
+def _key(result):
+    return result["scenario"], result.get("fixture")
+
+
+def print_results(results, baseline=None):
+    previous = {_key(result): result for result in (baseline or {}).get("results", [])}
+    for result in results:
+        label = result["scenario"] + (f" {result['fixture']}" if "fixture" in result else "")
+        line = f"{label:<44} mean {result['mean_ms']:>9.3f} ms"
+        if "p95_ms" in result:
+            line += f"  p95 {result['p95_ms']:>9.3f} ms  {result['throughput_per_s']:>8.2f}/s"
+            if result["errors"]:
+                line += f"  errors {result['errors']}"
+            if "provider_refreshes" in result:
+                line += f"  refreshes {result['provider_refreshes']}"
+        old = previous.get(_key(result))
+        if old and old.get("mean_ms"):
+            change = (result["mean_ms"] - old["mean_ms"]) / old["mean_ms"] * 100
+            line += f"  ({change:+.1f}% vs {baseline['commit']})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=60, help="requests per concurrent scenario")
+    parser.add_argument("--repeat", type=int, default=20, help="iterations of the in-process scenarios")
+    parser.add_argument("--parser-repeat", type=int, default=20)
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated thread counts")
+    parser.add_argument("--report-latency", type=float, default=0.0, help="ms added by the report host stub")
+    parser.add_argument("--bitrix-latency", type=float, default=0.0, help="ms added by the Bitrix24 stub")
+    parser.add_argument("--gcs-latency", type=float, default=0.0, help="ms added by the GCS stub")
+    parser.add_argument("--upload-backend", choices=("gcs", "local"), default="gcs")
+    parser.add_argument("--batch-size", type=int, default=10, help="items per /batch request")
+    parser.add_argument("--bitrix-rate", type=float, default=10000, help="client-side Bitrix24 requests per second")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results, stubs = run(args)
+    print_results(results, baseline)
+    if not args.no_save:
+        print(f"Saved {save(results, stubs, args)}")
+
+
+if __name__ == "__main__":
+    main()
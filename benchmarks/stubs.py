@@ -0,0 +1,185 @@
+"""Local stand-ins for the report host, Bitrix24, GCS and Redis used by the benchmarks.
+
+Each HTTP stub is a threaded server on 127.0.0.1 with an optional fixed
+latency per request, so the pipeline can be driven end to end without
+touching the network. FakeRedis stands in for a Redis client in-process.
+"""
+import email
+import glob
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class StubServer:
+    """Runs ``handler_class`` on a free local port until ``stop()``."""
+
+    def __init__(self, handler_class, latency=0.0):
+        self.requests = 0
+        self.latency = latency
+        # Anything the handler keeps between requests (e.g. stored objects)
+        self.state = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(handler_class):
+            stub = server
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=handler_class.__name__, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stub = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload, status=200):
+        self._send(status, json.dumps(payload).encode(), "application/json")
+
+
+def load_fixtures():
+    """Fixture name (file name without .html) -> page bytes."""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html"))):
+        with open(path, "rb") as f:
+            fixtures[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return fixtures
+
+
+class ReportHandler(_Handler):
+    """Serves the saved InBody pages: GET /reports/<fixture name>[?anything]."""
+
+    fixtures = load_fixtures()
+
+    def do_GET(self):
+        self.stub.count()
+        name = urlsplit(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+        body = self.fixtures.get(name)
+        if body is None:
+            self._send(404, b"not found", "text/plain")
+        else:
+            self._send(200, body, "text/html; charset=utf-8")
+
+
+class BitrixHandler(_Handler):
+    """Accepts rpa.item.update (webhook form or OAuth JSON) and batch calls like Bitrix24 does."""
+
+    def do_POST(self):
+        self.stub.count()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode()
+        method = urlsplit(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+
+        if method == "batch.json":
+            commands = [key[4:-1] for key in parse_qs(body) if key.startswith("cmd[")]
+            self._send_json({"result": {"result": {key: {"item": {}} for key in commands}, "result_error": []}})
+        elif method == "rpa.item.update.json":
+            self._send_json({"result": {"item": {}}})
+        else:
+            self._send_json({"error": "ERROR_METHOD_NOT_FOUND"}, status=404)
+
+
+class GCSHandler(_Handler):
+    """The slice of the GCS JSON API that GCSBackend uses: multipart object uploads.
+
+    Point google-cloud-storage at it with STORAGE_EMULATOR_HOST. Objects are
+    kept in memory, and ``ifGenerationMatch=0`` on an existing name answers
+    412 like GCS does, so the create-if-absent path runs for real.
+    """
+
+    def do_POST(self):
+        self.stub.count()
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if not parts.path.startswith("/upload/storage/v1/b/") or query.get("uploadType") != ["multipart"]:
+            self._send_json({"error": {"code": 404, "message": "Not Found"}}, status=404)
+            return
+
+        bucket = parts.path.split("/")[5]
+        message = email.message_from_bytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        metadata, media = message.get_payload()
+        name = json.loads(metadata.get_payload())["name"]
+        data = media.get_payload(decode=True)
+
+        with self.stub._lock:
+            objects = self.stub.state.setdefault("objects", {})
+            if query.get("ifGenerationMatch") == ["0"] and (bucket, name) in objects:
+                exists = True
+            else:
+                exists = False
+                objects[(bucket, name)] = data
+        if exists:
+            self._send_json({"error": {"code": 412, "message": "conditionNotMet"}}, status=412)
+        else:
+            self._send_json({"kind": "storage#object", "bucket": bucket, "name": name, "generation": "1", "size": str(len(data))})
+
+
+class FakeRedis:
+    """In-process stand-in for the subset of the Redis client tokens.RedisTokenBackend uses."""
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        expires_at = self._expiry.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            return self._data[key].encode() if self._live(key) else None
+
+    def set(self, key, value, nx=False, px=None):
+        with self._lock:
+            if nx and self._live(key):
+                return None
+            self._data[key] = value
+            self._expiry.pop(key, None)
+            if px is not None:
+                self._expiry[key] = time.monotonic() + px / 1000
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._expiry.pop(key, None)
+            return 1 if self._data.pop(key, None) is not None else 0
@@ -0,0 +1,127 @@
+"""Bitrix24 RPA writer that coalesces item updates into ``batch`` calls."""
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlencode
+
+MAX_BATCH_COMMANDS = 50  # Bitrix24's limit per batch call
+
+
+class BitrixError(Exception):
+    """A command inside a batch call was rejected by Bitrix24."""
+
+
+def rpa_update_command(rpa_id, fields, type_id=1):
+    """Encode one rpa.item.update call as a batch command string."""
+    params = {"typeId": type_id, "id": rpa_id}
+    for field_code, value in fields.items():
+        if value is not None:
+            params[f"fields[{field_code}]"] = value
+    return f"rpa.item.update?{urlencode(params)}"
+
+
+class BitrixBatchWriter:
+    """Buffers RPA updates and flushes them through Bitrix24's ``batch`` method.
+
+    ``submit()`` returns a Future resolved with that command's own result (or
+    a BitrixError carrying its error), so callers keep a one-to-one mapping
+    back to their rpa_id. A flush happens as soon as ``max_commands`` updates
+    are pending, or ``flush_interval`` seconds after the oldest one arrived.
+    ``http`` is anything with a requests-style ``post`` method.
+    """
+
+    def __init__(self, batch_url, http, max_commands=MAX_BATCH_COMMANDS, flush_interval=1.0, type_id=1):
+        self.batch_url = batch_url
+        self.http = http
+        self.max_commands = min(max_commands, MAX_BATCH_COMMANDS)
+        self.flush_interval = flush_interval
+        self.type_id = type_id
+        self._pending = []
+        self._oldest = None
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._flusher, name="bitrix-batch", daemon=True)
+        self._thread.start()
+
+    def submit(self, rpa_id, fields):
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("BitrixBatchWriter is closed")
+            self._sequence += 1
+            command = rpa_update_command(rpa_id, fields, self.type_id)
+            self._pending.append((f"rpa_{self._sequence}", rpa_id, command, future))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._condition.notify()
+        return future
+
+    def _take(self):
+        batch, self._pending = self._pending[:self.max_commands], self._pending[self.max_commands:]
+        self._oldest = time.monotonic() if self._pending else None
+        return batch
+
+    def _flusher(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if len(self._pending) >= self.max_commands:
+                        break
+                    if self._oldest is not None:
+                        remaining = self._oldest + self.flush_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+                if self._closed and not self._pending:
+                    return
+                batch = self._take()
+            self._send(batch)
+
+    def flush(self):
+        """Send everything pending now, in as many batch calls as needed."""
+        while True:
+            with self._condition:
+                batch = self._take()
+            if not batch:
+                return
+            self._send(batch)
+
+    def _send(self, batch):
+        data = {"halt": 0}
+        for key, _, command, _ in batch:
+            data[f"cmd[{key}]"] = command
+        try:
+            response = self.http.post(self.batch_url, data=data)
+            response.raise_for_status()
+            body = response.json()
+        except Exception as e:
+            logging.error(f"Bitrix24 batch of {len(batch)} updates failed: {e}")
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        result = body.get("result") or {}
+        # PHP serializes empty maps as [], so normalize both sections
+        results = result.get("result") or {}
+        errors = result.get("result_error") or {}
+        for key, rpa_id, _, future in batch:
+            if key in errors:
+                error = errors[key]
+                message = (error.get("error_description") or error.get("error")) if isinstance(error, dict) else error
+                future.set_exception(BitrixError(f"RPA {rpa_id}: {message}"))
+            elif isinstance(results, dict) and key in results:
+                future.set_result(results[key])
+            else:
+                future.set_exception(BitrixError(f"RPA {rpa_id}: no result returned for {key}"))
+        logging.info(f"Bitrix24 batch sent {len(batch)} updates, {len(errors)} failed")
+
+    def close(self):
+        """Flush what is pending and stop the background flusher."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
@@ -0,0 +1,307 @@
+"""Growth chart rendering with cached reference backgrounds and rendered PNGs."""
+import io
+import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+CURVE_COLUMNS = [
+    "3rd Percentile", "15th Percentile", "50th Percentile", "85th Percentile", "97th Percentile",
+    "-3SD Z-Scores", "-2SD Z-Scores", "-1SD Z-Scores", "Median Z-Scores",
+    "1SD Z-Scores", "2SD Z-Scores", "3SD Z-Scores", "3rd Z-Scores",
+    "15th Z-Scores", "Median Z Scores", "85th Z-Scores", "97th Z-Scores",
+]
+
+FIGSIZE = (6, 8)
+DPI = 100
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+
+def _draw_chart(data, metric_label, title, points=None, dpi=DPI):
+    """Build a Figure with the reference curves and, optionally, the child's points."""
+    fig = Figure(figsize=FIGSIZE, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    for col in CURVE_COLUMNS:
+        if col in data.columns:
+            ax.plot(data["Age (years)"], data[col], label=col)
+    offsets = np.empty((0, 2)) if points is None else np.asarray(points, dtype=float)
+    scatter = ax.scatter(*np.transpose(offsets), color="red", label="Child's Data", zorder=5)
+    # Joins successive measurements into a trajectory; hidden for a single point
+    trajectory, = ax.plot(*np.transpose(offsets), color="red", linewidth=1.5, zorder=4, visible=len(offsets) > 1)
+    ax.set_title(title)
+    ax.set_xlabel("Age (years)")
+    ax.set_ylabel(metric_label)
+    ax.legend()
+    ax.grid(True)
+    return fig, canvas, ax, scatter, trajectory
+
+
+def _encode_png(canvas, compress_level=6, palette=False):
+    image = Image.fromarray(np.asarray(canvas.buffer_rgba()))
+    if palette:
+        # Charts use a handful of flat colours, so 8-bit palette PNGs are far smaller
+        image = image.convert("RGB").quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    buffer = io.BytesIO()
+    image.save(buffer, format="png", compress_level=compress_level)
+    return buffer.getvalue()
+
+
+def _encode_svg(fig):
+    # Fixed ids and no timestamp keep identical charts byte-identical for de-duplication
+    buffer = io.BytesIO()
+    with matplotlib.rc_context({"svg.hashsalt": "growth-chart"}):
+        fig.savefig(buffer, format="svg", metadata={"Date": None})
+    return buffer.getvalue()
+
+
+class ChartBackground:
+    """A reference chart drawn once; renders only overlay the child's point.
+
+    The curves, axes, legend and grid are rasterized a single time and the
+    pixels kept. Each PNG render restores those pixels, blits the red point
+    on top and encodes the result, which skips nearly all of matplotlib's
+    drawing work; SVG output reuses the built figure and only moves the
+    point. Points outside the cached axes limits fall back to a full draw so
+    the chart still autoscales to include them.
+    """
+
+    def __init__(self, data, metric_label, title, fmt="png", dpi=DPI, compress_level=6, palette=False):
+        self.data = data
+        self.metric_label = metric_label
+        self.title = title
+        self.fmt = fmt
+        self.dpi = dpi
+        self.compress_level = compress_level
+        self.palette = palette
+        self.fig, self.canvas, self.ax, self.point, self.trajectory = _draw_chart(data, metric_label, title, dpi=dpi)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.lock = threading.Lock()
+
+    def _encode(self, fig, canvas):
+        if self.fmt == "svg":
+            return _encode_svg(fig)
+        return _encode_png(canvas, self.compress_level, self.palette)
+
+    def _in_view(self, points):
+        (x0, x1), (y0, y1) = sorted(self.ax.get_xlim()), sorted(self.ax.get_ylim())
+        return all(x0 <= age <= x1 and y0 <= value <= y1 for age, value in points)
+
+    def render(self, age, value):
+        return self.render_points([(age, value)])
+
+    def render_points(self, points):
+        """Render the chart with ``[(age, value), ...]`` plotted and, for several points, joined in order."""
+        if not self._in_view(points):
+            fig, canvas, _, _, _ = _draw_chart(self.data, self.metric_label, self.title, points=points, dpi=self.dpi)
+            if self.fmt != "svg":
+                canvas.draw()
+            return self._encode(fig, canvas)
+        with self.lock:
+            self.point.set_offsets(points)
+            self.trajectory.set_data(*np.transpose(points))
+            self.trajectory.set_visible(len(points) > 1)
+            try:
+                if self.fmt == "svg":
+                    return _encode_svg(self.fig)
+                self.canvas.restore_region(self.background)
+                if len(points) > 1:
+                    self.ax.draw_artist(self.trajectory)
+                self.ax.draw_artist(self.point)
+                return _encode_png(self.canvas, self.compress_level, self.palette)
+            finally:
+                self.trajectory.set_visible(False)
+
+
+class LRUCache:
+    """Thread-safe LRU map with hit/miss counters."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+def chart_key(table_key, age, value, metric_label, title):
+    return (table_key, float(age), float(value), metric_label, title)
+
+
+class ChartRenderer:
+    """Renders growth charts to in-memory bytes, reusing backgrounds and finished images.
+
+    Backgrounds are built lazily, once per (table, label, title) for the life
+    of the process. Finished images are kept in an LRU cache keyed by the
+    table and the child's (age, value), so a repeated measurement costs a
+    dict lookup. ``fmt`` is "png" or "svg"; PNGs honour ``dpi``,
+    ``compress_level`` and ``palette``.
+    """
+
+    def __init__(self, reference_data, cache_size=512, fmt="png", dpi=DPI, compress_level=6, palette=False):
+        if fmt not in CONTENT_TYPES:
+            raise ValueError(f"Unsupported chart format: {fmt}")
+        self.reference_data = reference_data
+        self.fmt = fmt
+        self.dpi = dpi
+        self.compress_level = compress_level
+        self.palette = palette
+        self.content_type = CONTENT_TYPES[fmt]
+        self._backgrounds = {}
+        self._backgrounds_lock = threading.Lock()
+        self.cache = LRUCache(cache_size)
+
+    def _background(self, table_key, metric_label, title):
+        key = (table_key, metric_label, title)
+        background = self._backgrounds.get(key)
+        if background is None:
+            with self._backgrounds_lock:
+                background = self._backgrounds.get(key)
+                if background is None:
+                    data = self.reference_data.get(table_key)
+                    if data is None:
+                        logging.error(f"Reference table {table_key} not loaded; chart will have no curves")
+                        data = pd.DataFrame()
+                    background = ChartBackground(
+                        data, metric_label, title,
+                        fmt=self.fmt, dpi=self.dpi, compress_level=self.compress_level, palette=self.palette,
+                    )
+                    self._backgrounds[key] = background
+        return background
+
+    def render(self, table_key, age, value, metric_label, title):
+        """Return the encoded bytes of ``table_key``'s chart with the child's point."""
+        key = chart_key(table_key, age, value, metric_label, title)
+        image = self.cache.get(key)
+        if image is None:
+            image = self._background(table_key, metric_label, title).render(float(age), float(value))
+            self.cache.put(key, image)
+        return image
+
+    def render_series(self, table_key, points, metric_label, title):
+        """Return ``table_key``'s chart with a trajectory through ``[(age, value), ...]``."""
+        points = [(float(age), float(value)) for age, value in points]
+        key = (table_key, tuple(points), metric_label, title)
+        image = self.cache.get(key)
+        if image is None:
+            image = self._background(table_key, metric_label, title).render_points(points)
+            self.cache.put(key, image)
+        return image
+
+
+class RenderPoolBusy(Exception):
+    """The render pool's queue stayed full for longer than the submit timeout."""
+
+
+# Per-process renderer inside each pool worker, created by _init_worker
+_worker_renderer = None
+
+
+def _init_worker(reference_data, renderer_options):
+    global _worker_renderer
+    _worker_renderer = ChartRenderer(reference_data, **renderer_options)
+
+
+def _ping():
+    return True
+
+
+def _render_in_worker(table_key, age, value, metric_label, title):
+    started = time.perf_counter()
+    image = _worker_renderer.render(table_key, age, value, metric_label, title)
+    return image, time.perf_counter() - started
+
+
+class ChartRenderPool:
+    """Renders charts on worker processes so they run in parallel, outside the GIL.
+
+    Workers are forked as soon as the pool is created, inheriting the
+    already-imported matplotlib and the reference tables, so create the pool
+    before the web worker starts any other threads. Each worker keeps its
+    own chart backgrounds. At most ``max_pending`` renders are queued;
+    further submissions wait up to ``submit_timeout`` seconds for a slot and
+    then raise RenderPoolBusy, so a burst cannot pile up unbounded work.
+    Finished images are cached only in the parent, which checks its cache
+    before submitting, so the workers keep just ``worker_cache_size``
+    images each rather than a duplicate of it.
+    """
+
+    def __init__(self, reference_data, workers, max_pending=64, submit_timeout=30.0, cache_size=512, worker_cache_size=0, **renderer_options):
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self.cache = LRUCache(cache_size)
+        self.submit_timeout = submit_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(reference_data, dict(renderer_options, cache_size=worker_cache_size)),
+        )
+        # The first submission launches every worker process
+        self._executor.submit(_ping).result()
+
+    def render_many(self, charts, timings=None):
+        """Render ``{key: (table_key, age, value, metric_label, title)}`` in parallel, returning ``{key: bytes}``.
+
+        If ``timings`` is a dict it receives each rendered key's time spent in
+        its worker; images served from the parent's cache are not timed.
+        """
+        images = {}
+        pending = {}
+        for key, args in charts.items():
+            cache_key = chart_key(*args)
+            image = self.cache.get(cache_key)
+            if image is not None:
+                images[key] = image
+                continue
+            if not self._slots.acquire(timeout=self.submit_timeout):
+                raise RenderPoolBusy(f"No render slot free after {self.submit_timeout}s")
+            try:
+                future = self._executor.submit(_render_in_worker, *args)
+            except BaseException:
+                # The done callback never gets attached, so give the slot back here
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda _: self._slots.release())
+            pending[key] = (cache_key, future)
+
+        for key, (cache_key, future) in pending.items():
+            images[key], elapsed = future.result()
+            self.cache.put(cache_key, images[key])
+            if timings is not None:
+                timings[key] = elapsed
+        return images
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
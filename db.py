@@ -0,0 +1,20 @@
+"""SQLite connections shared by the job queue, result cache, growth history and token store."""
+import sqlite3
+from contextlib import contextmanager
+
+
+@contextmanager
+def connect(db_path, row_factory=None):
+    """A WAL-mode connection to ``db_path`` in autocommit mode, closed on exit.
+
+    Statements commit on their own; wrap a read-modify-write in
+    ``BEGIN IMMEDIATE`` / ``COMMIT``. Writers wait up to 30 s for the lock.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        yield conn
+    finally:
+        conn.close()
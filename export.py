@@ -0,0 +1,196 @@
+"""Streaming CSV/Parquet export of recorded measurements and their z-scores.
+
+Rows are read from the growth history in batches and encoded as they go,
+so an export of any size runs in constant memory:
+
+    python export.py --format parquet --output measurements.parquet [--clinic A] [--since 2025-01-01]
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import datetime, timezone
+
+from history import COLUMNS, GrowthHistory
+from inbody import FIELD_NAMES, parse_number
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only Parquet export needs it
+    pa = pq = None
+
+# InBody fields not already exported as measurement columns, as numbers
+REPORT_COLUMNS = [name for name in FIELD_NAMES if name not in ("name", "age", "gender", "height", "weight", "bmi")]
+EXPORT_COLUMNS = ["id"] + COLUMNS + REPORT_COLUMNS
+TEXT_COLUMNS = {"child_id", "clinic", "report_url", "name", "gender_key"}
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def parse_time(value):
+    """Unix seconds from a number or an ISO 8601 date/time (UTC unless it says otherwise)."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def export_row(measurement):
+    row = {column: measurement[column] for column in ["id"] + COLUMNS}
+    report = measurement["report"]
+    for name in REPORT_COLUMNS:
+        row[name] = parse_number(report.get(name))
+    return row
+
+
+def iter_rows(history, batch_size=1000, **filters):
+    """Yield lists of flat export rows, one list per history batch."""
+    for batch in history.iter_batches(batch_size=batch_size, **filters):
+        yield [export_row(measurement) for measurement in batch]
+
+
+def iter_csv(history, batch_size=1000, **filters):
+    """Yield the export as CSV text, a header and then one chunk per batch."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for rows in iter_rows(history, batch_size, **filters):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """Write-only file for ParquetWriter that hands back what was written since the last drain.
+
+    ``tell()`` counts every byte ever written, so the footer's offsets stay
+    correct although the bytes themselves are not kept.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_schema():
+    return pa.schema([
+        (column, pa.string() if column in TEXT_COLUMNS else pa.int64() if column == "id" else pa.float64())
+        for column in EXPORT_COLUMNS
+    ])
+
+
+def iter_parquet(history, batch_size=1000, **filters):
+    """Yield the export as Parquet bytes, one row group per batch."""
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in iter_rows(history, batch_size, **filters):
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(history, fmt, batch_size=1000, **filters):
+    if fmt == "csv":
+        return (chunk.encode("utf-8") for chunk in iter_csv(history, batch_size, **filters))
+    if fmt == "parquet":
+        return iter_parquet(history, batch_size, **filters)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def write_export(history, path, fmt, batch_size=1000, progress=lambda written: None, **filters):
+    """Write the export to ``path`` (atomically, via a temporary file); returns bytes written."""
+    written = 0
+    temporary = path + ".tmp"
+    try:
+        with open(temporary, "wb") as f:
+            for chunk in iter_export(history, fmt, batch_size, **filters):
+                f.write(chunk)
+                written += len(chunk)
+                progress(written)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export recorded measurements and z-scores.")
+    parser.add_argument("--database", default=os.path.join(os.getenv("DATA_FOLDER", "data"), "history.sqlite3"))
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", required=True, help="file to write, or - for standard output (CSV only)")
+    parser.add_argument("--clinic")
+    parser.add_argument("--since", help="unix time or ISO date, inclusive")
+    parser.add_argument("--until", help="unix time or ISO date, exclusive")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        print(f"No growth history at {args.database}", file=sys.stderr)
+        return 1
+    history = GrowthHistory(args.database)
+    filters = {"clinic": args.clinic, "since": parse_time(args.since), "until": parse_time(args.until)}
+
+    if args.output == "-":
+        if args.format != "csv":
+            print("Only CSV can be written to standard output", file=sys.stderr)
+            return 1
+        for chunk in iter_csv(history, args.batch_size, **filters):
+            sys.stdout.write(chunk)
+        return 0
+
+    try:
+        written = write_export(history, args.output, args.format, args.batch_size, **filters)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Wrote {written} bytes to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Longitudinal store of every processed measurement, queried per child."""
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+from db import connect
+from lms import age_in_months
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    child_id TEXT NOT NULL,
+    clinic TEXT NOT NULL DEFAULT '',
+    report_url TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    gender_key TEXT NOT NULL,
+    measured_at REAL NOT NULL,
+    age_months REAL NOT NULL,
+    height REAL,
+    weight REAL,
+    bmi REAL,
+    bmifa_z REAL,
+    bmifa_percentile REAL,
+    hfa_z REAL,
+    hfa_percentile REAL,
+    wfa_z REAL,
+    wfa_percentile REAL,
+    report TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_measurements_child ON measurements (child_id, measured_at);
+CREATE INDEX IF NOT EXISTS idx_measurements_clinic ON measurements (clinic, measured_at);
+CREATE INDEX IF NOT EXISTS idx_measurements_clinic_id ON measurements (clinic, id);
+"""
+
+COLUMNS = [
+    "child_id", "clinic", "report_url", "name", "gender_key", "measured_at", "age_months",
+    "height", "weight", "bmi",
+    "bmifa_z", "bmifa_percentile", "hfa_z", "hfa_percentile", "wfa_z", "wfa_percentile",
+]
+
+
+# Names the report parser falls back to when the page has none
+PLACEHOLDER_NAMES = {"", "unknown"}
+
+
+def child_id_for(name, gender_key, clinic=""):
+    """Best-effort id for a child when the caller has none: clinic, normalized name and sex.
+
+    Children with the same name and sex in one clinic share this id, so it
+    is only a fallback; callers that need reliable histories pass their own
+    child_id. Returns None when the name is missing or a placeholder.
+    """
+    normalized = " ".join((name or "").lower().split())
+    if normalized in PLACEHOLDER_NAMES:
+        return None
+    return hashlib.sha256(f"{clinic}\0{normalized}\0{gender_key}".encode()).hexdigest()[:16]
+
+
+def report_child_id(report_url):
+    """Id for a report that cannot be linked to a child: a history of its own."""
+    return "report-" + hashlib.sha256(report_url.encode()).hexdigest()[:16]
+
+
+class GrowthHistory:
+    """SQLite-backed history of measurements with their InBody fields and z-scores.
+
+    Each report URL is recorded once, so re-processing a report does not add
+    a duplicate point. Per-child reads walk the (child_id, measured_at)
+    index and per-clinic reads the (clinic, measured_at) index, so they stay
+    proportional to the rows returned rather than to the table size.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect(self.db_path, row_factory=sqlite3.Row)
+
+    def record(self, report_url, extracted_data, measurements, scores, child_id=None, clinic="", measured_at=None):
+        """Store one processed report; returns the child_id its row is filed under.
+
+        Pass ``child_id`` for a reliable history. Without one the id is
+        derived from clinic, name and sex (see child_id_for), and a report
+        without a usable name is filed on its own rather than merged with
+        other unnamed reports. A report already recorded keeps its row, but
+        is re-filed when the caller passes a ``child_id`` or ``clinic``.
+        """
+        # Only what the caller actually supplied may re-file an existing row
+        refile = ["child_id"] if child_id or clinic else []
+        if clinic:
+            refile.append("clinic")
+        clinic = clinic or ""
+        if not child_id:
+            child_id = (child_id_for(extracted_data.get("name", ""), measurements["gender_key"], clinic)
+                        or report_child_id(report_url))
+        row = {
+            "child_id": child_id,
+            "clinic": clinic,
+            "report_url": report_url,
+            "name": extracted_data.get("name", ""),
+            "gender_key": measurements["gender_key"],
+            "measured_at": measured_at or time.time(),
+            "age_months": age_in_months(measurements["age"]),
+            "height": measurements["height"],
+            "weight": measurements["weight"],
+            "bmi": measurements["bmi"],
+        }
+        row.update({column: scores.get(column) for column in COLUMNS if column in scores})
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        if refile:
+            on_conflict = "DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in refile)
+        else:
+            on_conflict = "DO NOTHING"
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    f"INSERT INTO measurements ({', '.join(COLUMNS)}, report) VALUES ({placeholders}, ?) "
+                    f"ON CONFLICT (report_url) {on_conflict}",
+                    [row.get(column) for column in COLUMNS] + [json.dumps(extracted_data)],
+                )
+                stored = conn.execute("SELECT child_id FROM measurements WHERE report_url = ?", (report_url,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Recording growth history for {report_url} failed: {e}")
+            return child_id
+        return stored["child_id"] if stored is not None else child_id
+
+    def _rows(self, query, params):
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["report"] = json.loads(result["report"])
+            results.append(result)
+        return results
+
+    def child(self, child_id, limit=None):
+        """A child's measurements, oldest first; ``limit`` keeps only the most recent."""
+        if limit is None:
+            return self._rows(
+                "SELECT * FROM measurements WHERE child_id = ? ORDER BY measured_at, id",
+                (child_id,),
+            )
+        rows = self._rows(
+            "SELECT * FROM measurements WHERE child_id = ? ORDER BY measured_at DESC, id DESC LIMIT ?",
+            (child_id, limit),
+        )
+        return rows[::-1]
+
+    def clinic(self, clinic, since=None, limit=1000):
+        """A clinic's measurements, newest first, optionally only those after ``since``."""
+        return self._rows(
+            "SELECT * FROM measurements WHERE clinic = ? AND measured_at > ? ORDER BY measured_at DESC LIMIT ?",
+            (clinic or "", since or 0, limit),
+        )
+
+    def iter_batches(self, clinic=None, since=None, until=None, batch_size=1000):
+        """Yield every matching measurement in id order, ``batch_size`` rows at a time.
+
+        Each batch is a separate short query resuming after the last id seen
+        (through the (clinic, id) index when filtering by clinic), so a slow
+        consumer never holds a read transaction open and memory stays
+        bounded by one batch.
+        """
+        conditions = ["id > ?"]
+        params = []
+        if clinic is not None:
+            conditions.append("clinic = ?")
+            params.append(clinic)
+        if since is not None:
+            conditions.append("measured_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("measured_at < ?")
+            params.append(until)
+        query = f"SELECT * FROM measurements WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+
+        last_id = 0
+        while True:
+            rows = self._rows(query, [last_id, *params, batch_size])
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1]["id"]
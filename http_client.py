@@ -0,0 +1,138 @@
+"""Shared HTTP sessions with per-host connection pools, retries, rate limits and latency metrics."""
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """Token bucket: ``rate`` requests per second with bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "total_seconds": round(self.total_seconds, 3),
+            "mean_seconds": round(self.total_seconds / self.requests, 3) if self.requests else 0.0,
+            "max_seconds": round(self.max_seconds, 3),
+        }
+
+
+class HTTPClient:
+    """One keep-alive ``requests.Session`` per host, shared by every thread.
+
+    Each session mounts an adapter whose pool holds up to ``pool_maxsize``
+    connections, so repeated calls to the report host and Bitrix reuse TLS
+    connections. Connection errors and 429/5xx responses are retried with
+    exponential backoff, honouring ``Retry-After``; after the last attempt
+    the final response is returned for the caller to inspect. Hosts listed in
+    ``rate_limits`` (host -> (requests per second, burst)) are throttled
+    client-side so bulk runs stay inside the portal's limits. Pass
+    ``retries=0`` (or any other count) to a call to override the retry
+    budget, e.g. for single-use credentials that must never be resent.
+    """
+
+    def __init__(self, timeout=(5, 30), pool_maxsize=20, max_retries=3, backoff_factor=0.5, rate_limits=None):
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._limiters = {host: RateLimiter(rate, burst) for host, (rate, burst) in (rate_limits or {}).items()}
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _session(self, origin, retries):
+        session = self._sessions.get((origin, retries))
+        if session is None:
+            with self._lock:
+                session = self._sessions.get((origin, retries))
+                if session is None:
+                    retry = Retry(
+                        total=retries,
+                        backoff_factor=self.backoff_factor,
+                        status_forcelist=RETRY_STATUSES,
+                        allowed_methods=None,
+                        respect_retry_after_header=True,
+                        raise_on_status=False,
+                    )
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=retry)
+                    session = requests.Session()
+                    session.mount(origin, adapter)
+                    self._sessions[(origin, retries)] = session
+                    self._stats.setdefault(urlsplit(origin).netloc, HostStats())
+        return session
+
+    def request(self, method, url, retries=None, **kwargs):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        session = self._session(origin, self.max_retries if retries is None else retries)
+        limiter = self._limiters.get(parts.netloc)
+        if limiter is not None:
+            limiter.acquire()
+
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = session.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self._stats[parts.netloc]
+            with self._lock:
+                stats.requests += 1
+                stats.errors += failed
+                stats.total_seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+            if elapsed > 5:
+                logging.warning(f"Slow {method} to {parts.netloc}: {elapsed:.2f}s")
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """Per-host request counts, error counts and latency."""
+        with self._lock:
+            return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -0,0 +1,170 @@
+"""Single-pass parser for InBody result pages."""
+import re
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional; BeautifulSoup's html.parser is the fallback
+    lxml = None
+
+TD_CENTER_STYLE = "width:55%; text-align: right;"
+
+# Exact class attribute of a <span> -> (field, default)
+SPAN_FIELDS = {
+    "name abs": ("name", "Unknown"),
+    "old abs": ("age", "0"),
+    "sex abs": ("gender", "Unknown"),
+    "height abs": ("height", "0 cm"),
+}
+
+# Position among the matching <div>s -> field
+DATA_TEXT_FIELDS = {0: "weight", 1: "smm", 2: "body_fat_mass", 3: "bmi", 4: "pbf"}
+BOX_FIELDS = {0: "score"}
+BOLD_FIELDS = {
+    1: "ecf", 2: "cf", 3: "protein", 4: "minerals",
+    5: "fat", 6: "body_water", 7: "soft_lean_mass", 8: "fat_free_mass",
+}
+TD_CENTER_FIELDS = {0: "basal_metabolic_rate", 1: "bone_mineral", 2: "waist_hip_ratio", 3: "visceral_fat_level"}
+
+NUMBER_RE = re.compile(r"[-+]?\d+(?:[.,]\d+)?")
+
+
+def parse_number(text):
+    """First number in ``text`` as a float ("27.4 kg" -> 27.4), or None."""
+    if text is None:
+        return None
+    match = NUMBER_RE.search(text)
+    return float(match.group().replace(",", ".")) if match else None
+
+
+@dataclass
+class InBodyReport:
+    """Typed view of one report; ``raw`` keeps the page text and ``missing`` lists absent fields."""
+
+    name: str = "Unknown"
+    age: Optional[int] = None
+    gender: str = "Unknown"
+    height: Optional[float] = None
+    weight: Optional[float] = None
+    smm: Optional[float] = None
+    bmi: Optional[float] = None
+    pbf: Optional[float] = None
+    score: Optional[float] = None
+    ecf: Optional[float] = None
+    cf: Optional[float] = None
+    protein: Optional[float] = None
+    minerals: Optional[float] = None
+    fat: Optional[float] = None
+    body_water: Optional[float] = None
+    soft_lean_mass: Optional[float] = None
+    fat_free_mass: Optional[float] = None
+    body_fat_mass: Optional[float] = None
+    basal_metabolic_rate: Optional[float] = None
+    bone_mineral: Optional[float] = None
+    waist_hip_ratio: Optional[float] = None
+    visceral_fat_level: Optional[float] = None
+    raw: dict = field(default_factory=dict)
+    missing: list = field(default_factory=list)
+
+    def as_text_dict(self):
+        """Field -> page text, with the placeholder defaults the app has always sent for absent fields."""
+        data = {}
+        for name in FIELD_NAMES:
+            default = SPAN_DEFAULTS.get(name, "0")
+            data[name] = self.raw.get(name, default)
+        return data
+
+
+FIELD_NAMES = [f.name for f in fields(InBodyReport) if f.name not in ("raw", "missing")]
+SPAN_DEFAULTS = {name: default for name, default in SPAN_FIELDS.values()}
+TEXT_FIELDS = ("name", "gender")
+WANTED = {
+    "data_text": max(DATA_TEXT_FIELDS) + 1,
+    "box": max(BOX_FIELDS) + 1,
+    "bold": max(BOLD_FIELDS) + 1,
+    "td_center": max(TD_CENTER_FIELDS) + 1,
+}
+
+
+def _lxml_elements(content):
+    root = lxml.html.fromstring(content)
+    for el in root.iter("div", "span"):
+        yield el.tag, el.get("class", ""), el.get("style"), el
+
+
+def _bs4_elements(content):
+    soup = BeautifulSoup(content, "html.parser")
+    for el in soup.find_all(["div", "span"]):
+        yield el.name, " ".join(el.get("class", [])), el.get("style"), el
+
+
+def _text(el):
+    if lxml is not None and isinstance(el, lxml.html.HtmlElement):
+        return el.text_content().strip()
+    return el.get_text().strip()
+
+
+def _first_span(el):
+    if lxml is not None and isinstance(el, lxml.html.HtmlElement):
+        return el.find(".//span")
+    return el.find("span")
+
+
+def parse_report(content, backend=None):
+    """Parse a report page in one walk over its <div> and <span> elements.
+
+    ``backend`` is "lxml" or "bs4"; by default lxml is used when installed.
+    The walk stops as soon as every field has been seen.
+    """
+    if backend is None:
+        backend = "lxml" if lxml is not None else "bs4"
+    elements = _lxml_elements(content) if backend == "lxml" else _bs4_elements(content)
+
+    raw = {}
+    found = {group: [] for group in WANTED}
+    spans_left = set(SPAN_FIELDS)
+
+    for tag, class_attr, style, el in elements:
+        classes = class_attr.split()
+        class_attr = " ".join(classes)
+        if tag == "span":
+            if class_attr in spans_left:
+                raw[SPAN_FIELDS[class_attr][0]] = _text(el)
+                spans_left.discard(class_attr)
+        else:
+            if class_attr == "data-text font-size-nom bold" and len(found["data_text"]) < WANTED["data_text"]:
+                found["data_text"].append(el)
+            if "box" in classes and len(found["box"]) < WANTED["box"]:
+                found["box"].append(el)
+            if "bold" in classes and len(found["bold"]) < WANTED["bold"]:
+                found["bold"].append(el)
+            if class_attr == "td t-center" and style == TD_CENTER_STYLE and len(found["td_center"]) < WANTED["td_center"]:
+                found["td_center"].append(el)
+        if not spans_left and all(len(found[group]) == count for group, count in WANTED.items()):
+            break
+
+    for group, mapping in (("data_text", DATA_TEXT_FIELDS), ("box", BOX_FIELDS), ("bold", BOLD_FIELDS)):
+        for index, name in mapping.items():
+            if index < len(found[group]):
+                raw[name] = _text(found[group][index])
+    for index, name in TD_CENTER_FIELDS.items():
+        if index < len(found["td_center"]):
+            span = _first_span(found["td_center"][index])
+            if span is not None:
+                raw[name] = _text(span)
+
+    report = InBodyReport(raw=raw, missing=[name for name in FIELD_NAMES if name not in raw])
+    for name in FIELD_NAMES:
+        if name not in raw:
+            continue
+        if name in TEXT_FIELDS:
+            setattr(report, name, raw[name])
+        elif name == "age":
+            number = parse_number(raw[name])
+            report.age = int(number) if number is not None else None
+        else:
+            setattr(report, name, parse_number(raw[name]))
+    return report
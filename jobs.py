@@ -0,0 +1,166 @@
+"""SQLite-backed job queue with a local worker pool, retries and pollable status."""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from db import connect
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    run_after REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, run_after);
+"""
+
+
+class JobQueue:
+    """Durable queue shared by every process that opens the same database file.
+
+    Handlers are registered per job kind and called as
+    ``handler(payload, progress)``, where ``progress(text)`` records how far
+    the job has got. A handler's return value is stored as the job result; an
+    exception re-queues the job with exponential backoff until
+    ``max_attempts`` is reached. Jobs left ``running`` by a dead worker are
+    reclaimed once their lease expires.
+    """
+
+    def __init__(self, db_path, handlers=None, workers=2, max_attempts=3,
+                 retry_delay=5.0, lease_seconds=600.0, poll_interval=1.0):
+        self.db_path = db_path
+        self.handlers = dict(handlers or {})
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect(self.db_path, row_factory=sqlite3.Row)
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind, payload, max_attempts=None):
+        """Persist a job and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, max_attempts, progress, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), max_attempts or self.max_attempts, now, now, now),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Return the public view of a job (the payload is never exposed), or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "progress": row["progress"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def _claim(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?) "
+                    "OR (status = 'running' AND updated_at < ?) ORDER BY created_at LIMIT 1",
+                    (now, now - self.lease_seconds),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, progress = 'started', "
+                        "updated_at = ? WHERE id = ?",
+                        (now, row["id"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _update(self, job_id, **columns):
+        columns["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+
+    def _run(self, row):
+        job_id = row["id"]
+        attempts = row["attempts"] + 1
+        handler = self.handlers.get(row["kind"])
+        if handler is None:
+            self._update(job_id, status="failed", error=f"No handler registered for job kind {row['kind']}")
+            return
+        try:
+            result = handler(json.loads(row["payload"]), lambda text: self._update(job_id, progress=text))
+        except Exception as e:
+            if attempts < row["max_attempts"]:
+                delay = self.retry_delay * (2 ** (attempts - 1))
+                logging.warning(f"Job {job_id} attempt {attempts} failed, retrying in {delay}s: {e}")
+                self._update(job_id, status="queued", progress="retrying", error=str(e), run_after=time.time() + delay)
+            else:
+                logging.error(f"Job {job_id} failed after {attempts} attempts: {e}")
+                self._update(job_id, status="failed", progress="failed", error=str(e))
+            return
+        self._update(job_id, status="succeeded", progress="done", error=None, result=json.dumps(result))
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logging.error(f"Job queue claim failed: {e}")
+                row = None
+            if row is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(row)
+
+    def start(self):
+        """Start the worker threads for this process."""
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
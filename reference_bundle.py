@@ -0,0 +1,225 @@
+"""WHO reference tables: CSV loading, validation and a memory-mapped binary bundle.
+
+Build the bundle after changing any file in csv_files/:
+
+    python reference_bundle.py build
+
+Workers memory-map the bundle instead of parsing the CSVs, so every
+gunicorn worker shares one copy of the tables through the page cache.
+When the bundle is missing or was built from different CSVs, loading
+falls back to the CSVs.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_DATA = os.path.join(BASE_DIR, "csv_files", "reference_data.npy")
+BUNDLE_MANIFEST = os.path.join(BASE_DIR, "csv_files", "reference_data.json")
+
+CSV_FILES = {
+    "bmifa_boys_per": "csv_files/bmifa-boys-5-19years-per.csv",
+    "bmifa_boys_z": "csv_files/bmifa-boys-5-19years-z.csv",
+    "bmifa_girls_per": "csv_files/bmifa-girls-5-19years-per.csv",
+    "bmifa_girls_z": "csv_files/bmifa-girls-5-19years-z.csv",
+    "hfa_boys_per": "csv_files/hfa-boys-5-19years-per.csv",
+    "hfa_boys_z": "csv_files/sft-hfa-boys-perc-5-19years.csv",
+    "hfa_girls_per": "csv_files/hfa-girls-5-19years-per.csv",
+    "hfa_girls_z": "csv_files/sft-hfa-girls-perc-5-19years.csv",
+    "wfa_boys_per": "csv_files/wfa-boys-5-10years-per.csv",
+    "wfa_boys_z": "csv_files/wfa-boys-5-10years-z.csv",
+    "wfa_girls_per": "csv_files/wfa-girls-5-10years-per.csv",
+    "wfa_girls_z": "csv_files/wfa-girls-5-10years-z.csv",
+}
+
+COLUMN_MAPPING = {
+    "Year: Month": "Age (years)",
+    "Month": "Age (months)",
+    "3rd": "3rd Percentile",
+    "15th": "15th Percentile",
+    "50th": "50th Percentile",
+    "85th": "85th Percentile",
+    "97th": "97th Percentile",
+    "-3 SD": "-3SD Z-Scores",
+    "-2 SD": "-2SD Z-Scores",
+    "-1 SD": "-1SD Z-Scores",
+    "Median": "Median Z-Scores",
+    "1 SD": "1SD Z-Scores",
+    "2 SD": "2SD Z-Scores",
+    "3 SD": "3SD Z-Scores",
+    "3rdd": "3rd Z-Scores",
+    "15thh": "15th Z-Scores",
+    "Mediann": "Median Z Scores",
+    "85thh": "85th Z-Scores",
+    "97thh": "97th Z-Scores",
+}
+
+# "5:1", "5: 1" and "5:  1" all mean 5 years 1 month
+AGE_RE = re.compile(r"^\s*(\d+)\s*:\s*(\d+)\s*$")
+
+
+def parse_age(year_month):
+    match = AGE_RE.match(str(year_month))
+    if not match:
+        return None
+    years, months = map(int, match.groups())
+    return years + (months / 12)
+
+
+def normalize_columns(dataframe):
+    dataframe.rename(columns=COLUMN_MAPPING, inplace=True)
+    if "Age (years)" in dataframe.columns:
+        dataframe["Age (years)"] = dataframe["Age (years)"].apply(parse_age)
+    return dataframe
+
+
+def _path(relative_path):
+    return os.path.join(BASE_DIR, relative_path)
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def source_hashes():
+    return {key: _file_hash(_path(path)) for key, path in CSV_FILES.items()}
+
+
+def data_version(hashes):
+    """A single digest identifying this exact set of reference tables."""
+    return hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_csv_tables():
+    data = {}
+    for key, file_path in CSV_FILES.items():
+        try:
+            df = pd.read_csv(_path(file_path))
+            data[key] = normalize_columns(df)
+        except Exception as e:
+            logging.error(f"Error loading {file_path}: {e}")
+    return data
+
+
+def validate_table(key, df):
+    """Return a list of problems with one normalized table (empty when it is sound)."""
+    problems = []
+    months_column = "Age (months)" if "Age (months)" in df.columns else "Months"
+    for column in ("Age (years)", months_column):
+        if column not in df.columns:
+            problems.append(f"{key}: missing column {column!r}")
+    if problems:
+        return problems
+
+    non_numeric = [column for column in df.columns if not pd.api.types.is_numeric_dtype(df[column])]
+    if non_numeric:
+        problems.append(f"{key}: non-numeric columns {non_numeric}")
+    if df["Age (years)"].isna().any():
+        problems.append(f"{key}: unparseable ages in rows {list(df.index[df['Age (years)'].isna()])}")
+    if df.isna().any().any():
+        problems.append(f"{key}: missing values in {list(df.columns[df.isna().any()])}")
+    if not (df[months_column].diff().dropna() == 1).all():
+        problems.append(f"{key}: {months_column} is not a contiguous monthly sequence")
+    if not np.allclose(df["Age (years)"] * 12, df[months_column]):
+        problems.append(f"{key}: 'Year: Month' and {months_column} disagree")
+    if {"L", "M", "S"}.issubset(df.columns) and ((df["M"] <= 0).any() or (df["S"] <= 0).any()):
+        problems.append(f"{key}: non-positive M or S")
+
+    curves = [column for column in COLUMN_MAPPING.values() if column in df.columns and column.endswith(("Percentile", "Z-Scores", "Z Scores"))]
+    if curves and not (np.diff(df[curves].to_numpy(), axis=1) >= 0).all():
+        problems.append(f"{key}: reference curves are not ordered low to high")
+    return problems
+
+
+def build_bundle(data_path=BUNDLE_DATA, manifest_path=BUNDLE_MANIFEST):
+    """Validate the CSVs and write the bundle; raises ValueError listing any problems."""
+    tables = load_csv_tables()
+    problems = [f"{key}: failed to load" for key in CSV_FILES if key not in tables]
+    for key, df in tables.items():
+        problems.extend(validate_table(key, df))
+    if problems:
+        raise ValueError("Reference tables failed validation:\n  " + "\n  ".join(problems))
+
+    hashes = source_hashes()
+    manifest = {"version": data_version(hashes), "sources": hashes, "tables": {}}
+    chunks = []
+    offset = 0
+    for key, df in tables.items():
+        values = df.to_numpy(dtype=np.float64)
+        manifest["tables"][key] = {"columns": list(df.columns), "offset": offset, "rows": values.shape[0]}
+        chunks.append(values.ravel())
+        offset += values.size
+
+    # Write to temporary names and rename so running workers never see a partial bundle
+    np.save(data_path + ".tmp.npy", np.concatenate(chunks))
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(data_path + ".tmp.npy", data_path)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def load_bundle(data_path=BUNDLE_DATA, manifest_path=BUNDLE_MANIFEST):
+    """Memory-map the bundle; returns (tables, version), or None if it is missing or stale."""
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("sources") != source_hashes():
+        logging.warning("Reference data bundle is stale; loading the CSV files instead")
+        return None
+
+    values = np.load(data_path, mmap_mode="r")
+    tables = {}
+    for key, table in manifest["tables"].items():
+        columns = table["columns"]
+        start = table["offset"]
+        block = values[start:start + table["rows"] * len(columns)].reshape(table["rows"], len(columns))
+        tables[key] = pd.DataFrame(block, columns=columns, copy=False)
+    return tables, manifest["version"]
+
+
+def load_reference_tables():
+    """Reference tables as DataFrames plus their data version, preferring the bundle."""
+    try:
+        bundle = load_bundle()
+    except Exception as e:
+        logging.error(f"Error loading reference data bundle: {e}")
+        bundle = None
+    if bundle is not None:
+        return bundle
+    return load_csv_tables(), data_version(source_hashes())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or check the WHO reference data bundle.")
+    parser.add_argument("command", choices=["build", "check"])
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        try:
+            manifest = build_bundle()
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"Wrote {len(manifest['tables'])} tables to {BUNDLE_DATA} (version {manifest['version']})")
+        return 0
+
+    if load_bundle() is None:
+        print("Reference data bundle is missing or stale; run: python reference_bundle.py build", file=sys.stderr)
+        return 1
+    print("Reference data bundle is up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Persistent cache of processed reports, keyed by report URL and reference data version."""
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+from db import connect
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    version TEXT NOT NULL,
+    result TEXT NOT NULL,
+    delivered TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_results_created ON results (created_at);
+"""
+
+
+def delivery_key(target, rpa_id):
+    """One RPA item on one Bitrix24 endpoint; rpa_ids are only unique per portal."""
+    return f"{target}#{rpa_id}"
+
+
+class ResultCache:
+    """SQLite-backed store of parsed records, scores and chart URLs per report.
+
+    Entries are keyed by the report URL together with ``version`` (the
+    reference data and chart settings), so changing either invalidates old
+    results. Entries expire ``ttl`` seconds after they were written, and the
+    least recently used are evicted beyond ``max_entries``. The (target,
+    rpa_id) pairs a result has already been delivered to are tracked as
+    delivery_key strings so repeat deliveries can be acknowledged without
+    touching Bitrix24.
+    """
+
+    def __init__(self, db_path, version, ttl=7 * 24 * 3600, max_entries=10000):
+        self.db_path = db_path
+        self.version = version
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def _key(self, url):
+        return hashlib.sha256(f"{url}\0{self.version}".encode()).hexdigest()
+
+    def get(self, url):
+        """Return ``(result, delivered_keys)`` for a fresh entry, or None."""
+        key = self._key(url)
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT result, delivered FROM results WHERE key = ? AND created_at >= ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logging.error(f"Result cache read failed: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0]), set(json.loads(row[1]))
+
+    def put(self, url, result):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, url, version, result, delivered, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, '[]', ?, ?)",
+                    (self._key(url), url, self.version, json.dumps(result), now, now),
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            logging.error(f"Result cache write failed: {e}")
+
+    def mark_delivered(self, url, target, rpa_id):
+        """Record that the cached result for ``url`` has been sent to ``rpa_id`` through ``target``."""
+        key = self._key(url)
+        try:
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT delivered FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    delivered = set(json.loads(row[0])) | {delivery_key(target, rpa_id)}
+                    conn.execute("UPDATE results SET delivered = ? WHERE key = ?", (json.dumps(sorted(delivered)), key))
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.error(f"Result cache delivery update failed: {e}")
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM results WHERE key IN ("
+            "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
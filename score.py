@@ -0,0 +1,195 @@
+"""Offline bulk scoring of measurement files against the WHO reference tables.
+
+Reads a CSV or Parquet file with one child per row and writes the same rows
+with ``<indicator>_z`` and ``<indicator>_percentile`` columns added:
+
+    python score.py measurements.csv scored.csv [--workers 4] [--chunk-size 50000]
+
+Expected columns (rename with --column, e.g. --column age_months=age_m):
+sex ("male"/"female", "m"/"f", "boys"/"girls" or 1/2), age_months, and any
+of height (cm), weight (kg) and bmi. BMI is derived from height and weight
+when the column is absent or empty. The file is processed chunk by chunk,
+so memory stays bounded by ``--chunk-size`` rows per worker.
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from lms import LMSEngine
+from reference_bundle import load_reference_tables
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only Parquet input/output needs it
+    pa = pq = None
+
+INPUT_COLUMNS = ("sex", "age_months", "height", "weight", "bmi")
+
+SEX_KEYS = {
+    "male": "boys", "m": "boys", "boy": "boys", "boys": "boys", "1": "boys",
+    "female": "girls", "f": "girls", "girl": "girls", "girls": "girls", "2": "girls",
+}
+
+
+def normalize_sex(values):
+    """Map the usual spellings of sex to the reference tables' "boys"/"girls" (NaN otherwise)."""
+    text = values.astype(str).str.strip().str.lower().str.replace(r"\.0$", "", regex=True)
+    return text.map(SEX_KEYS)
+
+
+def score_frame(engine, frame, columns, decimals=2):
+    """Return ``frame`` with z-score and percentile columns for every indicator it has data for."""
+    sex = normalize_sex(frame[columns["sex"]]).to_numpy(dtype=object)
+    age_months = pd.to_numeric(frame[columns["age_months"]], errors="coerce").to_numpy(dtype=float)
+
+    measurements = {}
+    for name in ("height", "weight", "bmi"):
+        if columns[name] in frame.columns:
+            measurements[name] = pd.to_numeric(frame[columns[name]], errors="coerce").to_numpy(dtype=float)
+    if "height" in measurements and "weight" in measurements:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            derived = measurements["weight"] / (measurements["height"] / 100.0) ** 2
+        bmi = measurements.get("bmi")
+        measurements["bmi"] = derived if bmi is None else np.where(np.isnan(bmi), derived, bmi)
+
+    scored = frame.copy()
+    for key, values in engine.score_measurements(sex, age_months, measurements).items():
+        scored[key] = np.round(values, decimals) if decimals is not None else values
+    return scored
+
+
+# Per-process engine inside each pool worker, created by _init_worker
+_worker_engine = None
+
+
+def _init_worker():
+    global _worker_engine
+    tables, _ = load_reference_tables()
+    _worker_engine = LMSEngine.from_reference_data(tables)
+
+
+def _score_in_worker(frame, columns, decimals):
+    return score_frame(_worker_engine, frame, columns, decimals)
+
+
+def read_chunks(path, chunk_size):
+    """Yield DataFrames of up to ``chunk_size`` rows from a CSV or Parquet file."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise RuntimeError("Parquet input requires pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        if self.parquet and pq is None:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)")
+        self._writer = None
+        self._file = None
+
+    def write(self, frame):
+        if self.parquet:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table.cast(self._writer.schema))
+        else:
+            if self._file is None:
+                self._file = open(self.path, "w", newline="")
+                frame.to_csv(self._file, index=False)
+            else:
+                frame.to_csv(self._file, index=False, header=False)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def score_file(input_path, output_path, columns=None, chunk_size=50000, workers=0, decimals=2):
+    """Score every row of ``input_path`` into ``output_path``; returns the number of rows.
+
+    With ``workers`` > 0 chunks are scored on a process pool, at most two
+    per worker in flight, and written back in input order.
+    """
+    columns = dict({name: name for name in INPUT_COLUMNS}, **(columns or {}))
+    writer = ChunkWriter(output_path)
+    rows = 0
+    try:
+        if workers > 0:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                pending = collections.deque()
+                for chunk in read_chunks(input_path, chunk_size):
+                    pending.append(pool.submit(_score_in_worker, chunk, columns, decimals))
+                    if len(pending) >= workers * 2:
+                        scored = pending.popleft().result()
+                        writer.write(scored)
+                        rows += len(scored)
+                while pending:
+                    scored = pending.popleft().result()
+                    writer.write(scored)
+                    rows += len(scored)
+        else:
+            tables, _ = load_reference_tables()
+            engine = LMSEngine.from_reference_data(tables)
+            for chunk in read_chunks(input_path, chunk_size):
+                scored = score_frame(engine, chunk, columns, decimals)
+                writer.write(scored)
+                rows += len(scored)
+    finally:
+        writer.close()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file of measurements against the WHO reference tables.")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--column", action="append", default=[], metavar="NAME=COLUMN",
+                        help=f"input column holding one of {', '.join(INPUT_COLUMNS)}")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=0, help="score chunks on this many processes (0 = in this process)")
+    parser.add_argument("--decimals", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    columns = {}
+    for mapping in args.column:
+        name, _, column = mapping.partition("=")
+        if name not in INPUT_COLUMNS or not column:
+            parser.error(f"--column expects NAME=COLUMN with NAME one of {', '.join(INPUT_COLUMNS)}")
+        columns[name] = column
+
+    if not os.path.exists(args.input):
+        print(f"No such file: {args.input}", file=sys.stderr)
+        return 1
+    started = time.perf_counter()
+    try:
+        rows = score_file(args.input, args.output, columns, args.chunk_size, args.workers, args.decimals)
+    except KeyError as e:
+        print(f"Input has no column {e}; map it with --column", file=sys.stderr)
+        return 1
+    except RuntimeError as e:
+        print(f"Scoring failed: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+    print(f"Scored {rows} rows into {args.output} in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
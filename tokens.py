@@ -0,0 +1,224 @@
+"""Shared OAuth token store with proactive, single-flight refresh.
+
+Tokens live in a backend every worker can see (SQLite by default, or any
+Redis-compatible client) and are cached in-process, so serving a request
+normally touches neither the disk nor the network.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+
+from db import connect
+
+try:
+    import redis
+except ImportError:  # redis is optional; only the Redis backend needs it
+    redis = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS token_locks (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteTokenBackend:
+    """Tokens and refresh locks in a SQLite file shared by the workers on one host."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM tokens WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, token):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tokens (key, data, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(token), time.time()),
+            )
+
+    def acquire(self, key, owner, ttl):
+        """Take the refresh lock for ``key`` unless another owner holds an unexpired one."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM token_locks WHERE key = ? AND expires_at < ?", (key, now))
+            acquired = conn.execute(
+                "INSERT OR IGNORE INTO token_locks (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, owner, now + ttl),
+            ).rowcount == 1
+            conn.execute("COMMIT")
+        return acquired
+
+    def release(self, key, owner):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM token_locks WHERE key = ? AND owner = ?", (key, owner))
+
+
+class RedisTokenBackend:
+    """Tokens and refresh locks in Redis, shared by workers on every host.
+
+    ``client`` needs only ``get``, ``set`` (with ``nx``/``px``) and
+    ``delete``, so redis-py and the benchmarks' FakeRedis both work.
+    """
+
+    def __init__(self, client, prefix="growth:tokens:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        if redis is None:
+            raise RuntimeError("The Redis token backend requires redis (pip install redis)")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        data = self.client.get(f"{self.prefix}{key}")
+        return json.loads(data) if data else None
+
+    def set(self, key, token):
+        self.client.set(f"{self.prefix}{key}", json.dumps(token))
+
+    def acquire(self, key, owner, ttl):
+        return bool(self.client.set(f"{self.prefix}lock:{key}", owner, nx=True, px=int(ttl * 1000)))
+
+    def release(self, key, owner):
+        lock = f"{self.prefix}lock:{key}"
+        current = self.client.get(lock)
+        if current is not None and (current.decode() if isinstance(current, bytes) else current) == owner:
+            self.client.delete(lock)
+
+
+def normalize_token(token_data):
+    """Keep the fields the store needs and an absolute ``expires_at`` (Bitrix24 sends ``expires``/``expires_in``)."""
+    if "expires" in token_data:
+        expires_at = float(token_data["expires"])
+    else:
+        expires_at = time.time() + float(token_data.get("expires_in", 3600))
+    return {
+        "access_token": token_data["access_token"],
+        "refresh_token": token_data.get("refresh_token"),
+        "expires_at": expires_at,
+    }
+
+
+class TokenStore:
+    """OAuth tokens shared through ``backend``, refreshed before they expire.
+
+    ``refresh`` is called as ``refresh(refresh_token)`` and returns the
+    provider's token response (or None). A token within ``refresh_margin``
+    seconds of expiry is refreshed on read. Refreshes are single-flight:
+    threads in a process queue on a local lock and processes on the
+    backend's lock, and whoever waited picks up the token the winner stored
+    instead of refreshing again. Stored tokens are served from memory for up
+    to ``cache_seconds`` before the backend is consulted again. The refresh
+    lease lasts ``lock_ttl`` seconds and must be comfortably longer than a
+    ``refresh`` call can take, or a second worker refreshes concurrently.
+    """
+
+    def __init__(self, backend, refresh, refresh_margin=300.0, cache_seconds=30.0, lock_ttl=30.0):
+        self.backend = backend
+        self.refresh_token_func = refresh
+        self.refresh_margin = refresh_margin
+        self.cache_seconds = cache_seconds
+        self.lock_ttl = lock_ttl
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._refresh_locks = {}
+
+    def _cached(self, key):
+        with self._cache_lock:
+            entry = self._cache.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.cache_seconds:
+            return entry[0]
+        token = self.backend.get(key)
+        # A miss is not cached, so a token saved by another worker is seen on the next read
+        if token is not None:
+            self._remember(key, token)
+        return token
+
+    def _remember(self, key, token):
+        with self._cache_lock:
+            self._cache[key] = (token, time.monotonic())
+
+    def save(self, key, token_data):
+        """Store a fresh token response from the provider; returns the normalized token."""
+        token = normalize_token(token_data)
+        self.backend.set(key, token)
+        self._remember(key, token)
+        return token
+
+    def get(self, key):
+        """The stored token dict, or None if there is none."""
+        return self._cached(key)
+
+    def access_token(self, key):
+        """A usable access token, refreshed first if it is about to expire; None if there is none."""
+        token = self._cached(key)
+        if token is None:
+            return None
+        if token["expires_at"] - self.refresh_margin <= time.time():
+            return self.refresh(key, stale=token["access_token"]) or (
+                token["access_token"] if token["expires_at"] > time.time() else None
+            )
+        return token["access_token"]
+
+    def _local_lock(self, key):
+        with self._cache_lock:
+            return self._refresh_locks.setdefault(key, threading.Lock())
+
+    def refresh(self, key, stale=None):
+        """Refresh ``key``'s token and return the new access token (None if refreshing failed).
+
+        ``stale`` is the access token the caller found expired or rejected;
+        if the stored token has already moved on, that one is returned
+        without calling the provider.
+        """
+        with self._local_lock(key):
+            owner = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_ttl
+            while not self.backend.acquire(key, owner, self.lock_ttl):
+                # Another process is refreshing; wait for its token rather than refreshing twice
+                time.sleep(0.1)
+                token = self.backend.get(key)
+                if token is not None and token["access_token"] != stale:
+                    self._remember(key, token)
+                    return token["access_token"]
+                if time.monotonic() > deadline:
+                    logging.error(f"Timed out waiting for another worker to refresh the {key} token")
+                    return None
+            try:
+                token = self.backend.get(key)
+                if token is None:
+                    logging.error(f"No {key} token stored; authorize the app first")
+                    return None
+                if token["access_token"] != stale and token["expires_at"] - self.refresh_margin > time.time():
+                    self._remember(key, token)
+                    return token["access_token"]
+                if not token.get("refresh_token"):
+                    logging.error(f"No refresh token stored for {key}")
+                    return None
+
+                token_data = self.refresh_token_func(token["refresh_token"])
+                if not token_data or "access_token" not in token_data:
+                    return None
+                return self.save(key, token_data)["access_token"]
+            finally:
+                self.backend.release(key, owner)
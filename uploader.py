@@ -0,0 +1,132 @@
+"""Concurrent, de-duplicated chart uploads to GCS (or a local fake of it)."""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class GCSBackend:
+    """Writes objects to a Google Cloud Storage bucket."""
+
+    def __init__(self, storage_client, bucket_name):
+        from google.api_core.exceptions import PreconditionFailed
+
+        self._precondition_failed = PreconditionFailed
+        self.bucket = storage_client.bucket(bucket_name)
+        self.bucket_name = bucket_name
+
+    def put_if_absent(self, name, data, content_type):
+        """Create the object; return False if it already existed (one round trip either way)."""
+        blob = self.bucket.blob(name)
+        try:
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+        except self._precondition_failed:
+            return False
+        return True
+
+    def public_url(self, name):
+        return f"https://storage.googleapis.com/{self.bucket_name}/{name}"
+
+
+class LocalBackend:
+    """Filesystem stand-in for GCS, for development and benchmarks."""
+
+    def __init__(self, root, base_url=None):
+        self.root = root
+        self.base_url = base_url
+        os.makedirs(root, exist_ok=True)
+
+    def put_if_absent(self, name, data, content_type):
+        """Create the object; return False if it already existed.
+
+        The bytes go to a temporary file that is then hard-linked into place,
+        so a failed write never leaves a truncated object behind.
+        """
+        root = os.path.abspath(self.root)
+        path = os.path.abspath(os.path.join(root, name))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"Object name {name!r} escapes the upload directory")
+        fd, tmp_path = tempfile.mkstemp(dir=root, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(tmp_path)
+        return True
+
+    def public_url(self, name):
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{name}"
+        return f"file://{os.path.abspath(os.path.join(self.root, name))}"
+
+
+def content_address(name, data, extension):
+    """Object name for ``data``: the readable prefix plus a digest of the bytes.
+
+    The prefix comes from report data, so anything but letters, digits,
+    ``_`` and ``-`` (path separators and dots included) becomes ``_``.
+    """
+    prefix = re.sub(r"[^\w-]+", "_", name)
+    return f"{prefix}_{hashlib.sha256(data).hexdigest()[:16]}.{extension}"
+
+
+class ChartUploader:
+    """Uploads in-memory chart buffers concurrently on a shared thread pool.
+
+    Objects are content addressed, so identical charts map to the same name:
+    names already uploaded by this process are skipped outright, and the
+    backend's create-if-absent write turns a duplicate from another worker
+    into a cheap no-op. Failed uploads are retried with exponential backoff.
+    """
+
+    def __init__(self, backend, workers=8, max_attempts=3, backoff=0.5, known_size=4096):
+        self.backend = backend
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.known_size = known_size
+        self._known = OrderedDict()
+        self._known_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+
+    def _remember(self, name):
+        with self._known_lock:
+            self._known[name] = True
+            self._known.move_to_end(name)
+            while len(self._known) > self.known_size:
+                self._known.popitem(last=False)
+
+    def upload(self, name, data, content_type="image/png"):
+        """Upload one object, returning its public URL or None if every attempt failed."""
+        with self._known_lock:
+            if name in self._known:
+                return self.backend.public_url(name)
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if not self.backend.put_if_absent(name, data, content_type):
+                    logging.info(f"Skipped upload of {name}: identical object already stored")
+                self._remember(name)
+                return self.backend.public_url(name)
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    logging.error(f"Error uploading {name} after {attempt} attempts: {e}")
+                    return None
+                delay = self.backoff * (2 ** (attempt - 1))
+                logging.warning(f"Upload of {name} failed (attempt {attempt}), retrying in {delay}s: {e}")
+                time.sleep(delay)
+
+    def upload_many(self, objects, content_type="image/png"):
+        """Upload ``{key: (name, data)}`` concurrently and return ``{key: url}``."""
+        futures = {
+            key: self._pool.submit(self.upload, name, data, content_type)
+            for key, (name, data) in objects.items()
+        }
+        return {key: future.result() for key, future in futures.items()}